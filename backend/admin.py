@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+    Contact, ConfirmEmailToken, ImportJob, OutboxEvent
 
 
 @admin.register(User)
@@ -27,10 +27,10 @@ class CustomUserAdmin(UserAdmin):
 class ShopAdmin(admin.ModelAdmin):
     model = Shop
     fieldsets = (
-        (None, {'fields': ('name', 'state')}),
+        (None, {'fields': ('name', 'state', 'invoice_digest')}),
         ('Additional Info', {'fields': ('url', 'user')}),
     )
-    list_display = ('name', 'state', 'url')
+    list_display = ('name', 'state', 'invoice_digest', 'url')
 
 
 class ProductInline(admin.TabularInline):
@@ -83,10 +83,15 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     model = Order
-    fields = ('user', 'state', 'contact')
-    list_display = ('id', 'user', 'dt', 'state')
+    fields = ('user', 'state', 'contact', 'total')
+    readonly_fields = ('total',)
+    list_display = ('id', 'user', 'dt', 'state', 'total')
     inlines = [OrderItemInline, ]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_total()
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -100,4 +105,16 @@ class ContactAdmin(admin.ModelAdmin):
 
 @admin.register(ConfirmEmailToken)
 class ConfirmEmailTokenAdmin(admin.ModelAdmin):
-    list_display = ('user', 'key', 'created_at',)
\ No newline at end of file
+    list_display = ('user', 'key', 'created_at',)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'shop', 'state', 'rows', 'created_at', 'finished_at')
+    list_filter = ('state',)
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'attempts', 'created_at')
+    list_filter = ('task',)
@@ -0,0 +1,19 @@
+from django.urls import path
+
+from backend import urls
+from backend.async_views import AsyncCategoryView, AsyncShopView, AsyncProductInfoView, AsyncBasketView, \
+    AsyncOrderView
+
+app_name = 'backend'
+async_urlpatterns = [
+    path('categories', AsyncCategoryView.as_view(), name='categories'),
+    path('shops', AsyncShopView.as_view(), name='shops'),
+    path('products', AsyncProductInfoView.as_view(), name='shops'),
+    path('basket', AsyncBasketView.as_view(), name='basket'),
+    path('order', AsyncOrderView.as_view(), name='order'),
+]
+# остальные маршруты те же, что и под WSGI
+urlpatterns = async_urlpatterns + [
+    pattern for pattern in urls.urlpatterns
+    if str(pattern.pattern) not in {str(async_pattern.pattern) for async_pattern in async_urlpatterns}
+]
@@ -0,0 +1,259 @@
+from calendar import timegm
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, NotFound, \
+    ValidationError, Throttled
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from backend.authentication import AsyncTokenAuthentication, CachedTokenAuthentication
+from backend.cache import aversioned_cache_key, aversioned_etag, aget_modified, catalog_scope, user_catalog_scopes
+from backend.filters import CatalogItemFilter, OrderFilter
+from backend.models import Category, Shop, CatalogItem, Order
+from backend.pagination import ProductInfoCursorPagination, OrderCursorPagination
+from backend.renderers import UJSONRenderer
+from backend.serializers import CatalogItemSerializer, ORDER_SUMMARY_FIELDS, serialize_order_summaries, \
+    aserialize_orders
+from backend.views import BasketView, OrderView
+
+
+class AsyncAPIView(View):
+    """
+    Основа async-представлений для горячих чтений под ASGI: аутентификация по DEFAULT_AUTHENTICATION_CLASSES,
+    троттлинг, ETag/Last-Modified по версиям кэша и ответы UJSONRenderer, как у APIView.
+    Запросы с другими методами отдаются синхронному представлению sync_view
+    """
+    # токен проверяется асинхронно, остальные схемы (сессия) выполняются в потоке
+    authenticators = [
+        AsyncTokenAuthentication() if issubclass(authentication_class, CachedTokenAuthentication)
+        else authentication_class() for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ]
+    renderer = UJSONRenderer()
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    sync_view = None
+    sync_handler = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        if cls.sync_view is not None:
+            initkwargs['sync_handler'] = sync_to_async(cls.sync_view.as_view())
+        view = super().as_view(**initkwargs)
+        # csrf_exempt в Django 4.2 не оборачивает async-функции, CSRF для сессий проверяет sync_view
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.sync_handler is not None and request.method not in ('GET', 'HEAD'):
+            return await self.sync_handler(request, *args, **kwargs)
+
+        request = Request(request)
+        request.accepted_renderer = self.renderer
+        try:
+            request.user, request.auth = await self.authenticate(request) or (AnonymousUser(), None)
+            await sync_to_async(self.check_throttles)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return self.handle_exception(exc)
+
+    async def authenticate(self, request):
+        """
+        Как Request._authenticate: первая схема, вернувшая пользователя, побеждает
+        """
+        for authenticator in self.authenticators:
+            if isinstance(authenticator, AsyncTokenAuthentication):
+                user_auth = await authenticator.aauthenticate(request)
+            elif isinstance(authenticator, SessionAuthentication) and \
+                    settings.SESSION_COOKIE_NAME not in request.COOKIES:
+                # без cookie сессии пользователя нет, поток не занимаем
+                continue
+            else:
+                user_auth = await sync_to_async(authenticator.authenticate)(request)
+            if user_auth is not None:
+                return user_auth
+        return None
+
+    def check_throttles(self, request):
+        durations = [throttle.wait() for throttle in (throttle_class() for throttle_class in self.throttle_classes)
+                     if not throttle.allow_request(request, self)]
+        if durations:
+            raise Throttled(max((duration for duration in durations if duration is not None), default=None))
+
+    def handle_exception(self, exc):
+        response = self.render(exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail},
+                               exc.status_code)
+        if isinstance(exc, (AuthenticationFailed, NotAuthenticated)):
+            # как APIView: без заголовка WWW-Authenticate первой схемы ответ 403, а не 401
+            header = self.authenticators[0].authenticate_header(self.request)
+            if header:
+                response['WWW-Authenticate'] = header
+            else:
+                response.status_code = status.HTTP_403_FORBIDDEN
+        if getattr(exc, 'wait', None):
+            response['Retry-After'] = '%d' % exc.wait
+        return response
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type=self.renderer.media_type)
+
+    async def conditional(self, request, build, *scopes):
+        """
+        Как condition(): 304 по версиям областей кэша без обращения к базе, иначе ответ build(request)
+        """
+        etag = await aversioned_etag(request, *scopes)
+        last_modified = timegm(max([await aget_modified(scope) for scope in scopes]).utctimetuple())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await build(request)
+        if not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        response.headers.setdefault('ETag', etag)
+        return response
+
+
+class AsyncListView(AsyncAPIView):
+    """
+    Async-вариант VersionedListMixin с ListAPIView: страница из кэша по версии области,
+    при промахе страница PageNumberPagination читается через async ORM
+    """
+    queryset = None
+    fields = ()
+    cache_scope = None
+    cache_prefix = 'list'
+    cache_timeout_setting = 'LIST_CACHE_TIMEOUT'
+
+    def get_cache_scope(self, request):
+        return self.cache_scope
+
+    async def get(self, request, *args, **kwargs):
+        return await self.conditional(request, self.list, self.get_cache_scope(request))
+
+    async def list(self, request):
+        cache_key = await aversioned_cache_key(self.cache_prefix, self.get_cache_scope(request), request)
+        data = await cache.aget(cache_key)
+        if data is None:
+            data = await self.get_page(request)
+            await cache.aset(cache_key, data, getattr(settings, self.cache_timeout_setting))
+        return self.render(data)
+
+    async def get_page(self, request):
+        page_size = api_settings.PAGE_SIZE
+        count = await self.queryset.acount()
+        pages = max(-(-count // page_size), 1)
+        page = request.query_params.get(PageNumberPagination.page_query_param, 1)
+        try:
+            number = pages if page in PageNumberPagination.last_page_strings else int(page)
+        except ValueError:
+            number = 0
+        if not 1 <= number <= pages:
+            raise NotFound(PageNumberPagination.invalid_page_message)
+
+        url = request.build_absolute_uri()
+        if number == 1:
+            previous = None
+        elif number == 2:
+            previous = remove_query_param(url, PageNumberPagination.page_query_param)
+        else:
+            previous = replace_query_param(url, PageNumberPagination.page_query_param, number - 1)
+        offset = (number - 1) * page_size
+        return {
+            'count': count,
+            'next': replace_query_param(url, PageNumberPagination.page_query_param, number + 1)
+            if number < pages else None,
+            'previous': previous,
+            'results': [row async for row in self.queryset.values(*self.fields)[offset:offset + page_size]],
+        }
+
+
+class AsyncCategoryView(AsyncListView):
+    """
+    CategoryView под ASGI
+    """
+    queryset = Category.objects.all()
+    fields = ('id', 'name',)
+    cache_scope = 'categories'
+
+
+class AsyncShopView(AsyncListView):
+    """
+    ShopView под ASGI
+    """
+    queryset = Shop.objects.filter(state=True)
+    fields = ('id', 'name', 'state',)
+    cache_scope = 'shops'
+
+
+class AsyncProductInfoView(AsyncListView):
+    """
+    ProductInfoView под ASGI: выдача из витрины каталога с фильтрами и keyset-пагинацией
+    """
+    throttle_classes = (AnonRateThrottle,)
+    cache_prefix = 'products'
+    cache_timeout_setting = 'CATALOG_CACHE_TIMEOUT'
+
+    def get_cache_scope(self, request):
+        return catalog_scope(request)
+
+    async def get_page(self, request):
+        filterset = CatalogItemFilter(request.query_params, request=request,
+                                      queryset=CatalogItem.objects.filter(shop_state=True).only(
+                                          'product_info_id', 'data'))
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        paginator = ProductInfoCursorPagination()
+        page = await paginator.apaginate_queryset(filterset.qs, request, view=self)
+        return paginator.get_paginated_response(CatalogItemSerializer(page, many=True).data).data
+
+
+class AsyncBasketView(AsyncAPIView):
+    """
+    BasketView под ASGI: корзина читается через async ORM, изменения обслуживает BasketView
+    """
+    throttle_classes = (UserRateThrottle,)
+    sync_view = BasketView
+
+    async def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+        return await self.conditional(request, self.basket, *user_catalog_scopes(request.user.id))
+
+    async def basket(self, request):
+        return self.render(await aserialize_orders(Order.objects.filter(user_id=request.user.id, state='basket')))
+
+
+class AsyncOrderView(AsyncAPIView):
+    """
+    OrderView под ASGI: история заказов читается через async ORM, оформление обслуживает OrderView
+    """
+    throttle_classes = (UserRateThrottle,)
+    sync_view = OrderView
+
+    async def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+        return await self.conditional(request, self.history, f'user:{request.user.id}')
+
+    async def history(self, request):
+        filterset = OrderFilter(request.query_params, request=request, queryset=Order.objects.filter(
+            user_id=request.user.id).exclude(state='basket').values(*ORDER_SUMMARY_FIELDS))
+        if not filterset.is_valid():
+            return JsonResponse({'Status': False, 'Errors': filterset.errors},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = OrderCursorPagination()
+        page = await paginator.apaginate_queryset(filterset.qs, request, view=self)
+        return self.render(paginator.get_paginated_response(serialize_order_summaries(page)).data)
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+def token_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def user_token_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def token_cache_entries(token):
+    """
+    Записи кэша токена: токен с пользователем и ключ токена по пользователю, чтобы сбросить его без запроса к базе
+    """
+    return {token_cache_key(token.key): token, user_token_cache_key(token.user_id): token.key}
+
+
+def invalidate_user_tokens(user_id):
+    """
+    Сбрасывает кэш токена пользователя: при выходе, смене пароля и изменении пользователя
+    """
+    key = cache.get(user_token_cache_key(user_id))
+    if key is not None:
+        cache.delete_many([token_cache_key(key), user_token_cache_key(user_id)])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication с кэшем: токен вместе с пользователем хранится TOKEN_CACHE_TIMEOUT секунд,
+    база читается только при промахе. Неверные и неактивные токены не кэшируются
+    """
+
+    def authenticate_credentials(self, key):
+        token = cache.get(token_cache_key(key))
+        if token is None:
+            token = super().authenticate_credentials(key)[1]
+            cache.set_many(token_cache_entries(token), settings.TOKEN_CACHE_TIMEOUT)
+        return token.user, token
+
+
+class AsyncTokenAuthentication(CachedTokenAuthentication):
+    """
+    CachedTokenAuthentication для async-представлений: заголовок разбирается как в TokenAuthentication,
+    кэш и токен с пользователем читаются асинхронно
+    """
+
+    def authenticate_credentials(self, key):
+        return key
+
+    async def aauthenticate(self, request):
+        key = self.authenticate(request)
+        if key is None:
+            return None
+
+        token = await cache.aget(token_cache_key(key))
+        if token is None:
+            token = await self.get_model().objects.select_related('user').filter(key=key).afirst()
+            if token is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise AuthenticationFailed(_('User inactive or deleted.'))
+            await cache.aset_many(token_cache_entries(token), settings.TOKEN_CACHE_TIMEOUT)
+        return token.user, token
@@ -0,0 +1,225 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from rest_framework import status
+from ujson import dumps as dump_json
+
+# ответ-заглушка, пока запрос с ключом идемпотентности выполняется
+IDEMPOTENCY_IN_PROGRESS = 'in_progress'
+
+# версии кэша хранятся бессрочно, устаревшие записи вытесняются по TTL
+VERSION_TIMEOUT = None
+
+
+def version_key(scope):
+    return f'version:{scope}'
+
+
+def get_version(scope):
+    """
+    Текущая версия данных области кэша (магазина, каталога и т.п.)
+    """
+    key = version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, VERSION_TIMEOUT)
+        version = cache.get(key, 1)
+    return version
+
+
+async def aget_version(scope):
+    """
+    get_version для async-представлений
+    """
+    key = version_key(scope)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, 1, VERSION_TIMEOUT)
+        version = await cache.aget(key, 1)
+    return version
+
+
+def modified_key(scope):
+    return f'modified:{scope}'
+
+
+def get_modified(scope):
+    """
+    Время последнего изменения данных области кэша, для заголовка Last-Modified
+    """
+    key = modified_key(scope)
+    timestamp = cache.get(key)
+    if timestamp is None:
+        cache.add(key, time.time(), VERSION_TIMEOUT)
+        timestamp = cache.get(key, time.time())
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+async def aget_modified(scope):
+    key = modified_key(scope)
+    timestamp = await cache.aget(key)
+    if timestamp is None:
+        await cache.aadd(key, time.time(), VERSION_TIMEOUT)
+        timestamp = await cache.aget(key, time.time())
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def bump_version(scope):
+    """
+    Делает недействительными все записи кэша, построенные на старой версии области
+    """
+    key = version_key(scope)
+    cache.set(modified_key(scope), time.time(), VERSION_TIMEOUT)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, VERSION_TIMEOUT)
+        return cache.incr(key)
+
+
+def invalidate_shop(shop_id):
+    """
+    Данные магазина изменились: сбрасываем кэш магазина, общего каталога и списка магазинов
+    """
+    bump_version(f'shop:{shop_id}')
+    bump_version('catalog')
+    bump_version('shops')
+
+
+def versioned_cache_key(prefix, scope, request):
+    """
+    Ключ кэша ответа: запрос целиком плюс текущая версия области
+    """
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'{prefix}:{scope}:{get_version(scope)}:{digest}'
+
+
+async def aversioned_cache_key(prefix, scope, request):
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'{prefix}:{scope}:{await aget_version(scope)}:{digest}'
+
+
+def versioned_etag(request, *scopes):
+    """
+    ETag ответа из версий областей кэша и формата ответа, без обращения к базе
+    """
+    versions = '-'.join(f'{scope}.{get_version(scope)}' for scope in scopes)
+    return f'"{request.accepted_renderer.format}-{versions}"'
+
+
+async def aversioned_etag(request, *scopes):
+    versions = '-'.join([f'{scope}.{await aget_version(scope)}' for scope in scopes])
+    return f'"{request.accepted_renderer.format}-{versions}"'
+
+
+def invalidate_user(user_id):
+    """
+    Изменились корзина или заказы пользователя
+    """
+    bump_version(f'user:{user_id}')
+
+
+def user_etag(request, *args, **kwargs):
+    """
+    ETag истории заказов пользователя по версии user:{id}
+    """
+    if not request.user.is_authenticated:
+        return None
+    return versioned_etag(request, f'user:{request.user.id}')
+
+
+def user_last_modified(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    return get_modified(f'user:{request.user.id}')
+
+
+def user_catalog_scopes(user_id):
+    """
+    Области кэша корзины и заказа с позициями: в ответ входят текущие цены и остатки каталога,
+    поэтому кроме user:{id} учитывается версия catalog
+    """
+    return f'user:{user_id}', 'catalog'
+
+
+def user_catalog_etag(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    return versioned_etag(request, *user_catalog_scopes(request.user.id))
+
+
+def user_catalog_last_modified(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    return max(get_modified(scope) for scope in user_catalog_scopes(request.user.id))
+
+
+def catalog_scope(request):
+    """
+    Область кэша каталога: магазин из фильтра или весь каталог, если магазин не указан
+    """
+    shop_id = request.query_params.get('shop_id')
+    return f'shop:{shop_id}' if shop_id and shop_id.isdigit() else 'catalog'
+
+
+def catalog_cache_key(request):
+    """
+    Ключ кэша ответа каталога: запрос целиком плюс версия области каталога
+    """
+    return versioned_cache_key('products', catalog_scope(request), request)
+
+
+def idempotent(method):
+    """
+    Поддержка заголовка Idempotency-Key для методов APIView, возвращающих JsonResponse.
+    Ответ на первый запрос сохраняется в кэше на IDEMPOTENCY_TIMEOUT, повтор с тем же ключом отдает его
+    без обращения к базе; тот же ключ с другим телом запроса отклоняется. Пока первый запрос выполняется,
+    повтор получает 409, отметка об этом живет IDEMPOTENCY_LOCK_TIMEOUT
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or not request.user.is_authenticated:
+            return method(view, request, *args, **kwargs)
+
+        cache_key = 'idempotency:' + hashlib.md5(
+            f'{request.user.id}:{request.method}:{request.path}:{key}'.encode()).hexdigest()
+        fingerprint = hashlib.md5(dump_json(request.data, sort_keys=True).encode()).hexdigest()
+
+        if not cache.add(cache_key, IDEMPOTENCY_IN_PROGRESS, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored == IDEMPOTENCY_IN_PROGRESS:
+                return JsonResponse({'Status': False, 'Errors': 'Запрос с этим ключом еще выполняется'},
+                                    status=status.HTTP_409_CONFLICT)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return JsonResponse({'Status': False, 'Errors': 'Ключ уже использован с другим запросом'},
+                                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                response = HttpResponse(stored['content'], status=stored['status'],
+                                        content_type=stored['content_type'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            # запись вытеснена между add и get, выполняем запрос заново
+            cache.set(cache_key, IDEMPOTENCY_IN_PROGRESS, settings.IDEMPOTENCY_LOCK_TIMEOUT)
+
+        try:
+            response = method(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        # ошибки сервера не запоминаются, клиент может повторить запрос
+        if isinstance(response, JsonResponse) and response.status_code < 500:
+            cache.set(cache_key, {'fingerprint': fingerprint, 'status': response.status_code,
+                                  'content': response.content, 'content_type': response['Content-Type']},
+                      settings.IDEMPOTENCY_TIMEOUT)
+        else:
+            cache.delete(cache_key)
+        return response
+
+    return wrapper
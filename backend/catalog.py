@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Count, F
+
+from backend.importer import batched
+from backend.models import CatalogItem, ProductInfo, ProductParameter
+from backend.serializers import serialize_product_infos
+
+# поля витрины, перезаписываемые при обновлении строки
+CATALOG_FIELDS = ('shop', 'shop_state', 'category', 'product_name', 'model', 'price', 'parameters', 'data',
+                  'search_text')
+
+
+def refresh_catalog(product_infos):
+    """
+    Пересобирает строки витрины для позиций из queryset ProductInfo пачками.
+    Удаленные позиции уходят из витрины каскадом
+    """
+    ids = product_infos.order_by().values_list('id', flat=True)
+    refreshed = 0
+    for batch in batched(ids.iterator(), settings.IMPORT_BATCH_SIZE):
+        items = []
+        representations = serialize_product_infos(batch)
+        for product_info_id, shop_state, category_id in ProductInfo.objects.filter(id__in=batch).values_list(
+                'id', 'shop__state', 'product__category_id'):
+            data = representations[product_info_id]
+            parameters = {item['parameter']: item['value'] for item in data['product_parameters']}
+            items.append(CatalogItem(
+                product_info_id=product_info_id, shop_id=data['shop'], shop_state=shop_state,
+                category_id=category_id, product_name=data['product']['name'],
+                model=data['model'], price=data['price'],
+                parameters=parameters, data=data,
+                search_text=' '.join([data['product']['name'], data['model'], *parameters.values()])))
+        CatalogItem.objects.bulk_create(items, update_conflicts=True, unique_fields=['product_info'],
+                                        update_fields=CATALOG_FIELDS)
+        update_search_vector(batch)
+        refreshed += len(items)
+    return refreshed
+
+
+def set_shop_state(shop_ids, state):
+    """
+    Переносит в витрину смену статуса приема заказов одним запросом
+    """
+    return CatalogItem.objects.filter(shop_id__in=shop_ids).update(shop_state=state)
+
+
+def update_search_vector(ids):
+    """
+    Пересчитывает tsvector витрины одним UPDATE, полнотекстовый индекс есть только в PostgreSQL
+    """
+    if connection.vendor != 'postgresql':
+        return
+    config = settings.SEARCH_CONFIG
+    CatalogItem.objects.filter(pk__in=ids).update(
+        search_vector=SearchVector('product_name', weight='A', config=config) +
+        SearchVector('model', weight='B', config=config) +
+        SearchVector('search_text', weight='C', config=config))
+
+
+def search_catalog(queryset, text):
+    """
+    Полнотекстовый поиск по витрине, если ничего не нашлось - нечеткий поиск по триграммам.
+    Возвращает найденные позиции и они же, упорядоченные по релевантности
+    """
+    query = SearchQuery(text, config=settings.SEARCH_CONFIG, search_type='websearch')
+    matched = queryset.filter(search_vector=query)
+    if matched.exists():
+        return matched, matched.annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', 'pk')
+
+    matched = queryset.filter(search_text__trigram_word_similar=text)
+    return matched, matched.annotate(
+        similarity=TrigramWordSimilarity(text, 'search_text')).order_by('-similarity', 'pk')
+
+
+def catalog_facets(matched):
+    """
+    Количество найденных позиций по магазинам и по значениям параметров
+    """
+    matched = matched.order_by()
+    shops = [
+        {'id': row['shop_id'], 'name': row['shop__name'], 'count': row['count']}
+        for row in matched.values('shop_id', 'shop__name').annotate(count=Count('pk')).order_by('-count')
+    ]
+    parameters = {}
+    for row in ProductParameter.objects.filter(product_info_id__in=matched.values('pk')).values(
+            'parameter__name', 'value').annotate(count=Count('id')).order_by('-count')[:settings.SEARCH_FACET_LIMIT]:
+        parameters.setdefault(row['parameter__name'], []).append({'value': row['value'], 'count': row['count']})
+    return {'shops': shops, 'parameters': parameters}
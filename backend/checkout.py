@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models import F, Case, When, Value, PositiveIntegerField
+from rest_framework import status
+
+from backend.models import Order, OrderItem, ProductInfo, Contact
+from backend.outbox import enqueue
+
+
+class CheckoutError(Exception):
+    """
+    Заказ не может быть оформлен; errors уходят клиенту как есть со статусом status_code
+    """
+
+    def __init__(self, errors, status_code=status.HTTP_409_CONFLICT):
+        super().__init__(errors)
+        self.errors = errors
+        self.status_code = status_code
+
+
+def checkout(user_id, order_id, contact_id):
+    """
+    Оформляет корзину в заказ в одной транзакции: блокирует позиции каталога в порядке ИД,
+    проверяет статус магазинов и остатки, резервирует товар и фиксирует цены.
+    Возвращает оформленный заказ или бросает CheckoutError
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(user_id=user_id, id=order_id, state='basket').first()
+        if order is None:
+            raise CheckoutError('Корзина не найдена', status.HTTP_404_NOT_FOUND)
+        if not Contact.objects.filter(user_id=user_id, id=contact_id).exists():
+            raise CheckoutError('Контакт не найден')
+
+        quantities = dict(OrderItem.objects.filter(order_id=order.id).values_list('product_info_id', 'quantity'))
+        if not quantities:
+            raise CheckoutError('Корзина пуста')
+
+        # блокировки берутся в порядке ИД, поэтому встречные оформления не дают взаимоблокировок
+        product_infos = {
+            product_info_id: (quantity, price, shop_state)
+            for product_info_id, quantity, price, shop_state in ProductInfo.objects.select_for_update(
+                of=('self',)).filter(id__in=quantities).order_by('id').values_list(
+                'id', 'quantity', 'price', 'shop__state')
+        }
+
+        errors = []
+        for product_info_id, quantity in quantities.items():
+            if product_info_id not in product_infos or not product_infos[product_info_id][2]:
+                errors.append({'product_info': product_info_id,
+                               'Errors': 'Товар не найден или магазин не принимает заказы'})
+            elif product_infos[product_info_id][0] < quantity:
+                errors.append({'product_info': product_info_id, 'Errors': 'Недостаточно товара на складе',
+                               'available': product_infos[product_info_id][0]})
+        if errors:
+            raise CheckoutError(errors)
+
+        # резерв остатков и фиксация цен: по одному UPDATE ... CASE на таблицу
+        ProductInfo.objects.filter(id__in=quantities).update(quantity=Case(
+            *[When(id=product_info_id, then=F('quantity') - quantity)
+              for product_info_id, quantity in quantities.items()],
+            default=F('quantity'), output_field=PositiveIntegerField()))
+        OrderItem.objects.filter(order_id=order.id).update(price=Case(
+            *[When(product_info_id=product_info_id, then=Value(product_infos[product_info_id][1]))
+              for product_info_id in quantities],
+            default=F('price'), output_field=PositiveIntegerField()))
+
+        order.contact_id = contact_id
+        order.state = 'new'
+        order.total = sum(quantity * product_infos[product_info_id][1]
+                          for product_info_id, quantity in quantities.items())
+        order.save(update_fields=['contact', 'state', 'total'])
+
+        # остатки в витрине и кэш каталога обновит задача, она уйдет в брокер только после фиксации заказа
+        enqueue('backend.handlers.refresh_stock', product_info_ids=list(quantities))
+    return order
@@ -0,0 +1,41 @@
+from django.db.models import Q
+from django_filters import rest_framework as filters
+
+from backend.models import CatalogItem, Order, STATE_CHOICES
+
+
+class CatalogItemFilter(filters.FilterSet):
+    """
+    Фильтры каталога: магазин, категория, диапазон цены, текст и параметры.
+    Параметры задаются как ?parameter=Цвет:красный, можно несколько раз
+    """
+    shop_id = filters.NumberFilter(field_name='shop_id')
+    category_id = filters.NumberFilter(field_name='category_id')
+    price_min = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price_max = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    search = filters.CharFilter(method='filter_search')
+    parameter = filters.CharFilter(method='filter_parameters')
+
+    class Meta:
+        model = CatalogItem
+        fields = ('shop_id', 'category_id', 'price_min', 'price_max', 'search', 'parameter',)
+
+    def filter_search(self, queryset, name, value):
+        return queryset.filter(Q(product_name__icontains=value) | Q(model__icontains=value))
+
+    def filter_parameters(self, queryset, name, value):
+        parameters = dict(parameter.partition(':')[::2] for parameter in self.data.getlist(name))
+        return queryset.filter(parameters__contains=parameters)
+
+
+class OrderFilter(filters.FilterSet):
+    """
+    Фильтры истории заказов: статус (можно несколько) и период оформления
+    """
+    state = filters.MultipleChoiceFilter(field_name='state', choices=STATE_CHOICES)
+    date_from = filters.DateTimeFilter(field_name='dt', lookup_expr='gte')
+    date_to = filters.DateTimeFilter(field_name='dt', lookup_expr='lte')
+
+    class Meta:
+        model = Order
+        fields = ('state', 'date_from', 'date_to',)
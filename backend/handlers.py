@@ -1,27 +1,156 @@
+import csv
+import logging
+import time
+
 import requests
 import yaml
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.core.mail import EmailMultiAlternatives
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from yaml import load as load_yaml, Loader
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
 
-from backend.models import Shop, Category, Product, Parameter, ProductParameter, ProductInfo
+from backend.cache import invalidate_shop, bump_version
+from backend.catalog import refresh_catalog
+from backend.importer import PriceImporter
+from backend.invoices import invoice_sections, render_section, push_digest, pop_digest
+from backend.mail import build_messages, push_messages, pop_messages, ack_messages, restore_messages, send_batch
+from backend.models import Shop, ImportJob, ProductInfo
+from backend.price_lists import download, price_list_format, read_price_list
 from orders.celery import celery_app
-from orders.settings import EMAIL_HOST_USER
+
+logger = logging.getLogger(__name__)
+
+# dispatch_mail уже запланирован, новые письма попадут в его пачку
+MAIL_DISPATCH_LOCK = 'mail:dispatch'
 
 
 @celery_app.task()
-def send_email(message: str, email: str, *args, **kwargs) -> str:
-    title = 'Title'
-    email_list = list()
-    email_list.append(email)
-    try:
-        msg = EmailMultiAlternatives(subject=title, body=message, from_email=EMAIL_HOST_USER, to=email_list)
-        msg.send()
-        return f'Title: {msg.subject}, Message:{msg.body}'
-    except Exception as e:
-        raise e
+def send_email(title: str, message: str, email: str) -> str:
+    """
+    Ставит письмо в очередь рассылки, отправит его dispatch_mail
+    """
+    queue_email(title, message, [email])
+    return f'Title: {title}, Message:{message}'
+
+
+def queue_email(subject, body, recipients, html=None):
+    """
+    Кладет письма в очередь и, если рассылка еще не запланирована, планирует dispatch_mail
+    через MAIL_DISPATCH_DELAY секунд, чтобы письма за это время ушли одной пачкой
+    """
+    push_messages(build_messages(subject, body, recipients, html))
+    schedule_dispatch()
+
+
+def schedule_dispatch():
+    if cache.add(MAIL_DISPATCH_LOCK, 1, settings.MAIL_DISPATCH_DELAY * 2):
+        dispatch_mail.apply_async(countdown=settings.MAIL_DISPATCH_DELAY)
+
+
+@celery_app.task()
+def dispatch_mail():
+    """
+    Разбирает очередь писем пачками по MAIL_BATCH_SIZE, каждая пачка уходит через одно SMTP-соединение.
+    Неотправленные письма возвращаются в очередь с экспоненциальной задержкой
+    """
+    cache.delete(MAIL_DISPATCH_LOCK)
+    sent = 0
+    while batch := pop_messages(settings.MAIL_BATCH_SIZE):
+        messages = [message for _, message in batch]
+        failed = send_batch(messages)
+        sent += len(messages) - len(failed)
+        for message in failed:
+            message['attempt'] += 1
+            if message['attempt'] > settings.MAIL_MAX_RETRIES:
+                logger.error('Письмо %s не отправлено после %s попыток', message['to'], settings.MAIL_MAX_RETRIES)
+                continue
+            backoff = settings.MAIL_RETRY_BACKOFF * 2 ** (message['attempt'] - 1)
+            requeue_email.apply_async((message,), countdown=backoff)
+        # пачка отправлена или передана на повтор, теперь ее можно убрать из обрабатываемых
+        ack_messages([entry for entry, _ in batch])
+    return {'sent': sent}
+
+
+@celery_app.task()
+def requeue_email(message):
+    """
+    Возвращает письмо в очередь после задержки повтора
+    """
+    push_messages([message])
+    schedule_dispatch()
+
+
+@celery_app.task()
+def restore_mail():
+    """
+    Возвращает в очередь письма, которые рассылка взяла, но не отправила из-за падения воркера
+    """
+    restored = restore_messages()
+    if restored:
+        logger.warning('Возвращено в очередь писем упавшей рассылки: %s', restored)
+        schedule_dispatch()
+    return {'restored': restored}
+
+
+@celery_app.task()
+def send_invoices(order_id):
+    """
+    Накладные по оформленному заказу: каждому магазину его позиции, администратору весь заказ.
+    Раздел магазина рендерится один раз; магазины в режиме сводки получат заказ в send_invoice_digests
+    """
+    sections = invoice_sections([order_id])
+    rendered = [render_section(section) for section in sections]
+    subject = f'Накладная по заказу № {order_id}'
+    for section, text in zip(sections, rendered):
+        if not section['email']:
+            continue
+        if section['digest']:
+            push_digest(section['shop_id'], order_id)
+        else:
+            queue_email(subject, text, [section['email']])
+    if rendered:
+        queue_email(subject, '\n'.join(rendered), settings.INVOICE_ADMIN_EMAILS)
+    return {'shops': len(sections)}
+
+
+@celery_app.task()
+def send_invoice_digests():
+    """
+    Магазинам в режиме сводки все накопленные с прошлого раза заказы уходят одним письмом
+    """
+    sent = 0
+    for shop_id, shop_name, email in Shop.objects.filter(invoice_digest=True, user__isnull=False).values_list(
+            'id', 'name', 'user__email'):
+        order_ids = pop_digest(shop_id)
+        if not order_ids:
+            continue
+        sections = invoice_sections(order_ids, shop_id)
+        body = render_to_string('backend/invoice_digest.txt', {
+            'shop': shop_name, 'sections': sections, 'total': sum(section['total'] for section in sections)})
+        queue_email(f'Сводка накладных: заказов {len(sections)}', body, [email])
+        sent += 1
+    return {'digests': sent}
+
+
+def refresh_shops(product_infos, *shop_ids):
+    """
+    Переносит позиции в витрину и сбрасывает кэш каталога их магазинов и магазинов shop_ids
+    """
+    refresh_catalog(product_infos)
+    for shop_id in set(product_infos.values_list('shop_id', flat=True)) | set(shop_ids):
+        invalidate_shop(shop_id)
+
+
+@celery_app.task()
+def refresh_stock(product_info_ids):
+    """
+    Переносит в витрину остатки позиций после оформления заказа и сбрасывает кэш каталога их магазинов
+    """
+    refresh_shops(ProductInfo.objects.filter(id__in=product_info_ids))
 
 
 def open_file(shop):
@@ -30,48 +159,174 @@ def open_file(shop):
     return data
 
 
-@celery_app.task()
-def get_import(url, user_id):
+def update_job(job_id, **fields):
+    """
+    Обновляет запись ImportJob, если импорт запущен через PartnerUpdate
+    """
+    if job_id:
+        ImportJob.objects.filter(id=job_id).update(**fields)
+
+
+def fail_job(job_id, result):
+    update_job(job_id, state='failed', finished_at=timezone.now(),
+               error=result.get('Error') or result.get('Errors', ''))
+    return result
+
+
+def job_stats(stats):
+    return {'rows': stats['rows'], **stats['changes']}
+
+
+@celery_app.task(bind=True)
+def get_import(self, url, user_id, incremental=True, job_id=None):
+    """
+    Координатор импорта: потоково читает прайс, загружает справочники и раздает
+    пачки позиций задачам import_chunk, итог после последней пачки подводит finish_import
+    """
+    try:
+        return run_import(self, url, user_id, incremental, job_id)
+    except Exception as e:
+        # непредвиденная ошибка не должна оставлять ImportJob в статусе running
+        fail_job(job_id, {'Status': False, 'Error': str(e)})
+        raise
+
+
+def run_import(task, url, user_id, incremental=True, job_id=None):
     if url:
+        update_job(job_id, state='running', started_at=timezone.now())
         validate_url = URLValidator()
         try:
             validate_url(url)
         except ValidationError as e:
-            return {'Status': False, 'Error': str(e)}
-        else:
-            stream = requests.get(url).content
+            return fail_job(job_id, {'Status': False, 'Error': str(e)})
 
-        data = load_yaml(stream, Loader=Loader)
+        # условный запрос по ETag/Last-Modified прошлой загрузки этого же прайса,
+        # полная перезаливка всегда скачивает и загружает прайс заново
+        known = Shop.objects.filter(user_id=user_id, url=url).first() if incremental else None
         try:
-            shop, _ = Shop.objects.get_or_create(name=data['shop'],
-                                                 user_id=user_id)
-        except IntegrityError as e:
-            return {'Status': False, 'Error': str(e)}
-
-        for category in data['categories']:
-            category_object, _ = Category.objects.get_or_create(
-                id=category['id'], name=category['name'])
-            category_object.shops.add(shop.id)
-            category_object.save()
-
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-        for item in data['goods']:
-            product, _ = Product.objects.get_or_create(
-                name=item['name'], category_id=item['category']
-            )
-            product_info = ProductInfo.objects.create(
-                product_id=product.id, external_id=item['id'],
-                model=item['model'], price=item['price'],
-                price_rrc=item['price_rrc'], quantity=item['quantity'],
-                shop_id=shop.id
-            )
-            for name, value in item['parameters'].items():
-                parameter_object, _ = Parameter.objects.get_or_create(
-                    name=name
-                )
-                ProductParameter.objects.create(
-                    product_info_id=product_info.id,
-                    parameter_id=parameter_object.id, value=value
-                )
-        return {'Status': True}
-    return {'Status': False, 'Errors': 'Url is false'}
\ No newline at end of file
+            if known:
+                file, headers, price_hash = download(url, known.price_etag, known.price_last_modified)
+            else:
+                file, headers, price_hash = download(url)
+        except requests.RequestException as e:
+            return fail_job(job_id, {'Status': False, 'Error': str(e)})
+
+        source = {'url': url, 'price_etag': headers.get('ETag', ''),
+                  'price_last_modified': headers.get('Last-Modified', ''), 'price_hash': price_hash}
+        if known and (file is None or price_hash == known.price_hash):
+            if file is not None:
+                file.close()
+                Shop.objects.filter(id=known.id).update(**source)
+            update_job(job_id, shop_id=known.id, state='done', finished_at=timezone.now())
+            return {'Status': True, 'Skipped': 'Price list is not modified'}
+
+        started = time.time()
+        with file:
+            records = read_price_list(file, price_list_format(url, headers.get('Content-Type', '')))
+            try:
+                _, shop_name = next(records)
+                shop, _ = Shop.objects.get_or_create(name=shop_name,
+                                                     user_id=user_id)
+                update_job(job_id, shop_id=shop.id)
+                # полная перезаливка и импорт без ImportJob, по которому отслеживаются пачки,
+                # остаются последовательными в одной транзакции
+                if not incremental or not job_id:
+                    importer = PriceImporter(shop, incremental=incremental)
+                    stats = importer.run(records)
+                    # инкрементальный импорт обновляет в витрине только измененные позиции,
+                    # удаленные уходят из нее каскадом
+                    Shop.objects.filter(id=shop.id).update(**source)
+                    refresh_shops(ProductInfo.objects.filter(
+                        (Q(id__in=importer.changed) if incremental else Q(shop_id=shop.id))
+                        | Q(product__category_id__in=importer.renamed_categories)), shop.id)
+                    bump_version('categories')
+                    update_job(job_id, state='done', finished_at=timezone.now(), **job_stats(stats))
+                    return {'Status': True, 'Stats': stats}
+
+                # каждая пачка уходит в брокер сразу после подготовки, в памяти координатора
+                # остаются только внешние ИД позиций для поиска удаленных
+                importer = PriceImporter(shop, batch_size=settings.IMPORT_SHARD_SIZE)
+                chunks = 0
+                for batch, products in importer.prepare(records):
+                    import_chunk.apply_async((
+                        shop.id, batch,
+                        [[name, category_id, product_id] for (name, category_id), product_id in products.items()],
+                        {name: importer.parameters[name] for item in batch for name in item['parameters']},
+                        job_id, started, source), link_error=fail_import.s(job_id))
+                    chunks += 1
+                    if task.request.id:
+                        task.update_state(state='PROGRESS', meta={'chunks': chunks})
+            except (IntegrityError, ValueError, KeyError, yaml.YAMLError, csv.Error) as e:
+                return fail_job(job_id, {'Status': False, 'Error': str(e)})
+
+        # категории уже записаны координатором, пакетно и без сигналов моделей, кэш списка сбрасываем явно
+        bump_version('categories')
+        # смена названия категории затрагивает витрину всех магазинов
+        if importer.renamed_categories:
+            refresh_shops(ProductInfo.objects.filter(product__category_id__in=importer.renamed_categories))
+        # пачки пишут только позиции из прайса, поэтому список удаленных известен сразу,
+        # а удаляются они в finish_import, только если записаны все пачки
+        update_job(job_id, chunks=chunks, stale=importer.find_stale())
+        if not chunks:
+            return finish_import(shop.id, started, job_id, source)
+        finish_when_done(shop.id, started, job_id, source)
+        return {'Status': True, 'Chunks': chunks}
+    return fail_job(job_id, {'Status': False, 'Errors': 'Url is false'})
+
+
+def finish_when_done(shop_id, started, job_id, source):
+    """
+    Запускает finish_import, когда обработаны все пачки. Вызывается координатором после раздачи
+    и каждой пачкой: условное обновление finished_at пропускает только один запуск
+    """
+    if ImportJob.objects.filter(id=job_id, state='running', finished_at__isnull=True, chunks__gt=0,
+                                chunks_done=F('chunks')).update(finished_at=timezone.now()):
+        finish_import.delay(shop_id, started, job_id, source)
+
+
+@celery_app.task()
+def import_chunk(shop_id, goods, products, parameters, job_id, started, source):
+    """
+    Записывает пачку позиций прайса, справочники для нее уже разрешены координатором.
+    Пачки фиксируются независимо: если одна из них упала, каталог остается обновленным частично,
+    а хэш прайса не сохраняется, и повторный импорт того же прайса догружает разницу
+    """
+    importer = PriceImporter(Shop.objects.get(id=shop_id))
+    importer.parameters = parameters
+    with transaction.atomic():
+        importer.write(goods, {(name, category_id): product_id for name, category_id, product_id in products})
+        refresh_catalog(ProductInfo.objects.filter(id__in=importer.changed))
+    # счетчики пачки сразу видны в ImportJob как прогресс
+    update_job(job_id, chunks_done=F('chunks_done') + 1, rows=F('rows') + importer.rows,
+               **{key: F(key) + value for key, value in importer.changes.items()})
+    finish_when_done(shop_id, started, job_id, source)
+    return {'rows': importer.rows, 'changes': importer.changes}
+
+
+@celery_app.task()
+def finish_import(shop_id, started, job_id, source):
+    """
+    Завершает импорт после последней пачки: удаляет позиции, пропавшие из прайса, запоминает
+    ETag/Last-Modified/хэш загруженного прайса и подводит статистику по счетчикам ImportJob
+    """
+    importer = PriceImporter(Shop.objects.get(id=shop_id))
+    with transaction.atomic():
+        importer.delete_stale(ImportJob.objects.filter(id=job_id).values_list('stale', flat=True).get())
+        refresh_catalog(ProductInfo.objects.filter(id__in=importer.changed))
+    update_job(job_id, stale=[], deleted=F('deleted') + importer.changes['deleted'])
+    Shop.objects.filter(id=shop_id).update(**source)
+    invalidate_shop(shop_id)
+    counters = ImportJob.objects.filter(id=job_id).values('rows', *importer.changes).get()
+    importer.rows = counters.pop('rows')
+    importer.changes.update(counters)
+    stats = importer.stats(time.time() - started)
+    update_job(job_id, state='done', finished_at=timezone.now())
+    return {'Status': True, 'Stats': stats}
+
+
+@celery_app.task()
+def fail_import(request, exc, traceback, job_id=None):
+    """
+    Вызывается, если одна из пачек импорта завершилась ошибкой
+    """
+    fail_job(job_id, {'Status': False, 'Error': str(exc)})
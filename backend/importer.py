@@ -0,0 +1,269 @@
+import logging
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from backend.models import Category, Product, Parameter, ProductInfo, ProductParameter, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+def batched(iterable, size):
+    """
+    Разбивает поток на списки фиксированного размера
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class PriceImporter:
+    """
+    Пакетная загрузка прайса поставщика: справочники разрешаются несколькими
+    запросами на пачку, позиции пишутся через bulk_create/bulk_update.
+
+    В инкрементальном режиме позиции сопоставляются с имеющимися по (магазин, external_id)
+    и в базу попадают только вставки, изменения и удаления
+    """
+
+    # поля ProductInfo, изменения которых переносятся при инкрементальном импорте
+    info_fields = ('product', 'model', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, shop, batch_size=None, incremental=True):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.incremental = incremental
+        # кэш имен параметров на все время импорта, их немного
+        self.parameters = {}
+        self.rows = 0
+        self.changes = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        # внешние ИД, встреченные в прайсе, для отсева повторов и поиска удаленных позиций
+        self.seen = set()
+        # добавленные и измененные позиции и переименованные категории для обновления витрины
+        self.changed = set()
+        self.renamed_categories = set()
+        # позиции из корзин и заказов, оставленные при удалении
+        self.kept = 0
+
+    def run(self, records):
+        """
+        Загрузка прайса в одной транзакции, возвращает статистику.
+        Записи прайса приходят потоком, в память попадает одна пачка позиций
+        """
+        started = time.monotonic()
+        with transaction.atomic():
+            if not self.incremental:
+                self.delete_stale()
+            for batch, products in self.prepare(records):
+                self.write(batch, products)
+            if self.incremental:
+                self.delete_stale()
+        return self.stats(time.monotonic() - started)
+
+    def prepare(self, records):
+        """
+        Группирует поток записей прайса в пачки по batch_size позиций, загружает категории
+        и разрешает продукты и параметры пачки. Отдает пары (пачка, {(название, категория): id})
+        """
+        categories, goods = [], []
+        for kind, value in records:
+            if kind == 'category':
+                categories.append(value)
+            elif kind == 'good':
+                # при повторе внешнего ИД в прайсе побеждает первая запись: пачки могут писаться параллельно,
+                # и одна позиция не должна попасть в две из них
+                external_id = int(value['id'])
+                if external_id in self.seen:
+                    continue
+                self.seen.add(external_id)
+                goods.append(value)
+                if len(goods) >= self.batch_size:
+                    yield self.prepare_batch(categories, goods)
+                    categories, goods = [], []
+        if goods:
+            yield self.prepare_batch(categories, goods)
+        elif categories:
+            self.import_categories(categories)
+
+    def prepare_batch(self, categories, goods):
+        if categories:
+            self.import_categories(categories)
+        for item in goods:
+            item['parameters'] = {name: str(value) for name, value in item['parameters'].items()}
+        products = self.resolve_products(goods)
+        self.resolve_parameters({name for item in goods for name in item['parameters']})
+        return goods, products
+
+    def write(self, batch, products):
+        """
+        Записывает подготовленную пачку позиций
+        """
+        # оставшиеся после полной перезаливки позиции из заказов сопоставляются с прайсом
+        if self.incremental or self.kept:
+            self.merge_batch(batch, products, self.parameters)
+        else:
+            self.create_batch(batch, products, self.parameters)
+        self.rows += len(batch)
+
+    def stats(self, elapsed):
+        rows_per_second = round(self.rows / elapsed, 1) if elapsed else float(self.rows)
+        logger.info('Импорт магазина %s: %s позиций за %.2f с (%s позиций/с), изменения: %s',
+                    self.shop.id, self.rows, elapsed, rows_per_second, self.changes)
+        return {'rows': self.rows, 'seconds': round(elapsed, 3), 'rows_per_second': rows_per_second,
+                'changes': self.changes}
+
+    def import_categories(self, categories):
+        names = {int(category['id']): category['name'] for category in categories}
+        existing = Category.objects.in_bulk(list(names))
+
+        to_create = [Category(id=category_id, name=name)
+                     for category_id, name in names.items() if category_id not in existing]
+        to_update = []
+        for category_id, category in existing.items():
+            if category.name != names[category_id]:
+                category.name = names[category_id]
+                to_update.append(category)
+                self.renamed_categories.add(category_id)
+
+        Category.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Category.objects.bulk_update(to_update, ['name'], batch_size=self.batch_size)
+        Category.shops.through.objects.bulk_create(
+            [Category.shops.through(category_id=category_id, shop_id=self.shop.id) for category_id in names],
+            batch_size=self.batch_size, ignore_conflicts=True)
+
+    def build_info(self, item, products):
+        return ProductInfo(product_id=products[(item['name'], int(item['category']))],
+                           external_id=int(item['id']), model=item['model'], price=int(item['price']),
+                           price_rrc=int(item['price_rrc']), quantity=int(item['quantity']), shop_id=self.shop.id)
+
+    def create_batch(self, batch, products, parameters):
+        product_infos = ProductInfo.objects.bulk_create([self.build_info(item, products) for item in batch],
+                                                        batch_size=self.batch_size)
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info_id=product_info.id, parameter_id=parameters[name], value=value)
+            for item, product_info in zip(batch, product_infos)
+            for name, value in item['parameters'].items()
+        ], batch_size=self.batch_size)
+        self.changes['created'] += len(product_infos)
+        self.changed.update(product_info.id for product_info in product_infos)
+
+    def merge_batch(self, batch, products, parameters):
+        """
+        Сравнивает пачку с имеющимися позициями магазина и применяет только разницу
+        """
+        existing = {
+            product_info.external_id: product_info
+            for product_info in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[int(item['id']) for item in batch]).only(
+                'id', 'external_id', *self.info_fields)
+        }
+        current_parameters = {}
+        for product_parameter in ProductParameter.objects.filter(
+                product_info_id__in=[product_info.id for product_info in existing.values()]).only(
+                'id', 'product_info_id', 'parameter_id', 'value'):
+            current_parameters.setdefault(product_parameter.product_info_id, {})[
+                product_parameter.parameter_id] = product_parameter
+
+        new_items, changed_infos = [], []
+        parameters_to_create, parameters_to_update, parameters_to_delete = [], [], []
+        for item in batch:
+            product_info = existing.get(int(item['id']))
+            if product_info is None:
+                new_items.append(item)
+                continue
+
+            wanted = self.build_info(item, products)
+            info_changed = False
+            for field in self.info_fields:
+                attname = ProductInfo._meta.get_field(field).attname
+                if getattr(product_info, attname) != getattr(wanted, attname):
+                    setattr(product_info, attname, getattr(wanted, attname))
+                    info_changed = True
+
+            parameters_changed = False
+            current = current_parameters.get(product_info.id, {})
+            wanted_parameters = {parameters[name]: value for name, value in item['parameters'].items()}
+            for parameter_id, value in wanted_parameters.items():
+                product_parameter = current.get(parameter_id)
+                if product_parameter is None:
+                    parameters_to_create.append(ProductParameter(
+                        product_info_id=product_info.id, parameter_id=parameter_id, value=value))
+                    parameters_changed = True
+                elif product_parameter.value != value:
+                    product_parameter.value = value
+                    parameters_to_update.append(product_parameter)
+                    parameters_changed = True
+            for parameter_id, product_parameter in current.items():
+                if parameter_id not in wanted_parameters:
+                    parameters_to_delete.append(product_parameter.id)
+                    parameters_changed = True
+
+            if info_changed:
+                changed_infos.append(product_info)
+            if info_changed or parameters_changed:
+                self.changes['updated'] += 1
+                self.changed.add(product_info.id)
+            else:
+                self.changes['unchanged'] += 1
+
+        ProductInfo.objects.bulk_update(changed_infos, self.info_fields, batch_size=self.batch_size)
+        ProductParameter.objects.filter(id__in=parameters_to_delete).delete()
+        ProductParameter.objects.bulk_update(parameters_to_update, ['value'], batch_size=self.batch_size)
+        ProductParameter.objects.bulk_create(parameters_to_create, batch_size=self.batch_size)
+        if new_items:
+            self.create_batch(new_items, products, parameters)
+
+    def find_stale(self):
+        """
+        ИД позиций магазина, которых больше нет в прайсе (не попали в seen)
+        """
+        return [product_info_id for product_info_id, external_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id).values_list('id', 'external_id').iterator() if external_id not in self.seen]
+
+    def delete_stale(self, stale=None):
+        """
+        Удаляет позиции магазина, которых больше нет в прайсе, или позиции из списка stale.
+        Позиции, на которые ссылаются корзины и заказы, остаются с нулевым остатком
+        """
+        if stale is None:
+            stale = self.find_stale()
+        for ids in batched(stale, self.batch_size):
+            ordered = set(OrderItem.objects.filter(product_info_id__in=ids).values_list('product_info_id', flat=True))
+            self.changes['deleted'] += ProductInfo.objects.filter(
+                id__in=[product_info_id for product_info_id in ids if product_info_id not in ordered]).delete()[1].get(
+                ProductInfo._meta.label, 0)
+            self.changes['deleted'] += ProductInfo.objects.filter(id__in=ordered).exclude(quantity=0).update(
+                quantity=0)
+            self.changed.update(ordered)
+            self.kept += len(ordered)
+
+    def resolve_products(self, batch):
+        """
+        Возвращает {(название, категория): id}, недостающие продукты создаются одним запросом
+        """
+        keys = {(item['name'], int(item['category'])) for item in batch}
+        products = {
+            (name, category_id): product_id
+            for product_id, name, category_id in Product.objects.filter(
+                name__in={name for name, _ in keys},
+                category_id__in={category_id for _, category_id in keys}).values_list('id', 'name', 'category_id')
+            if (name, category_id) in keys
+        }
+        created = Product.objects.bulk_create(
+            [Product(name=name, category_id=category_id) for name, category_id in keys - products.keys()])
+        products.update({(product.name, product.category_id): product.id for product in created})
+        return products
+
+    def resolve_parameters(self, names):
+        """
+        Возвращает {название: id} для параметров, недостающие создаются одним запросом
+        """
+        missing = names - self.parameters.keys()
+        if missing:
+            self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+            created = Parameter.objects.bulk_create(
+                [Parameter(name=name) for name in missing - self.parameters.keys()])
+            self.parameters.update({parameter.name: parameter.id for parameter in created})
+        return self.parameters
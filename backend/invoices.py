@@ -0,0 +1,60 @@
+from django.template.loader import render_to_string
+
+from backend.mail import get_queue
+from backend.models import OrderItem
+
+
+def digest_key(shop_id):
+    return f'invoice:digest:{shop_id}'
+
+
+def invoice_sections(order_ids, shop_id=None):
+    """
+    Накладные по заказам одним запросом: по разделу на пару (заказ, магазин)
+    с позициями магазина, его суммой и адресом доставки
+    """
+    items = OrderItem.objects.filter(order_id__in=order_ids).order_by('order_id', 'shop_id', 'id')
+    if shop_id is not None:
+        items = items.filter(shop_id=shop_id)
+
+    sections = {}
+    for row in items.values('order_id', 'order__dt', 'order__user__email', 'order__contact__city',
+                            'order__contact__street', 'order__contact__house', 'order__contact__structure',
+                            'order__contact__building', 'order__contact__apartment', 'order__contact__phone',
+                            'shop_id', 'shop__name', 'shop__user__email', 'shop__invoice_digest',
+                            'product_info__external_id', 'product_info__model', 'product_info__product__name',
+                            'quantity', 'price'):
+        section = sections.get((row['order_id'], row['shop_id']))
+        if section is None:
+            section = sections[row['order_id'], row['shop_id']] = {
+                'order_id': row['order_id'], 'dt': row['order__dt'], 'buyer': row['order__user__email'],
+                'contact': {field: row[f'order__contact__{field}'] for field in (
+                    'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')},
+                'shop_id': row['shop_id'], 'shop': row['shop__name'], 'email': row['shop__user__email'],
+                'digest': row['shop__invoice_digest'], 'items': [], 'total': 0,
+            }
+        section['items'].append({'external_id': row['product_info__external_id'],
+                                 'name': row['product_info__product__name'], 'model': row['product_info__model'],
+                                 'quantity': row['quantity'], 'price': row['price'],
+                                 'sum': row['quantity'] * row['price']})
+        section['total'] += row['quantity'] * row['price']
+    return list(sections.values())
+
+
+def render_section(section):
+    return render_to_string('backend/invoice.txt', {'section': section})
+
+
+def push_digest(shop_id, order_id):
+    get_queue().rpush(digest_key(shop_id), order_id)
+
+
+def pop_digest(shop_id):
+    """
+    Забирает накопленные для сводки заказы магазина, список читается и очищается атомарно
+    """
+    pipeline = get_queue().pipeline()
+    pipeline.lrange(digest_key(shop_id), 0, -1)
+    pipeline.delete(digest_key(shop_id))
+    order_ids, _ = pipeline.execute()
+    return [int(order_id) for order_id in dict.fromkeys(order_ids)]
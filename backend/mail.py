@@ -0,0 +1,124 @@
+import logging
+import smtplib
+
+import redis
+import ujson
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+
+logger = logging.getLogger(__name__)
+
+# очередь исходящих писем: список в Redis, по одному письму на получателя
+MAIL_QUEUE_KEY = 'mail:queue'
+# письма, взятые рассылкой и еще не отправленные, и снимок этого списка для restore_messages
+MAIL_PROCESSING_KEY = 'mail:processing'
+MAIL_PROCESSING_SNAPSHOT_KEY = 'mail:processing:snapshot'
+
+
+def get_queue():
+    return redis.Redis.from_url(settings.MAIL_QUEUE_URL)
+
+
+def build_messages(subject, body, recipients, html=None):
+    """
+    Письма для очереди: каждому получателю отдельное, чтобы повторять отправку по получателю
+    """
+    return [{'subject': subject, 'body': body, 'to': email, 'html': html, 'attempt': 0}
+            for email in dict.fromkeys(recipients) if email]
+
+
+def push_messages(messages):
+    if messages:
+        get_queue().rpush(MAIL_QUEUE_KEY, *[ujson.dumps(message) for message in messages])
+
+
+def pop_messages(count):
+    """
+    Переносит до count писем из очереди в список обрабатываемых одной транзакцией LMOVE.
+    Оттуда их убирает ack_messages после отправки или возврата в очередь, поэтому падение
+    рассылки посреди пачки письма не теряет. Возвращает пары (запись очереди, письмо)
+    """
+    pipeline = get_queue().pipeline()
+    for _ in range(count):
+        pipeline.lmove(MAIL_QUEUE_KEY, MAIL_PROCESSING_KEY, 'LEFT', 'RIGHT')
+    return [(entry, ujson.loads(entry)) for entry in pipeline.execute() if entry is not None]
+
+
+def ack_messages(entries):
+    """
+    Убирает обработанные записи из списка обрабатываемых
+    """
+    if entries:
+        pipeline = get_queue().pipeline()
+        for entry in entries:
+            pipeline.lrem(MAIL_PROCESSING_KEY, 1, entry)
+        pipeline.execute()
+
+
+def restore_messages():
+    """
+    Возвращает в очередь письма упавшей рассылки: запись, которая лежала в списке обрабатываемых
+    и при прошлом вызове, считается брошенной. Интервал вызовов должен быть больше времени отправки пачки.
+    Возвращает число восстановленных писем
+    """
+    queue = get_queue()
+    previous = queue.smembers(MAIL_PROCESSING_SNAPSHOT_KEY)
+    current, restored = [], 0
+    for entry in queue.lrange(MAIL_PROCESSING_KEY, 0, -1):
+        if entry in previous:
+            queue.pipeline().lrem(MAIL_PROCESSING_KEY, 1, entry).rpush(MAIL_QUEUE_KEY, entry).execute()
+            restored += 1
+        else:
+            current.append(entry)
+    pipeline = queue.pipeline().delete(MAIL_PROCESSING_SNAPSHOT_KEY)
+    if current:
+        pipeline.sadd(MAIL_PROCESSING_SNAPSHOT_KEY, *current)
+    pipeline.execute()
+    return restored
+
+
+def build_email(message, connection):
+    email = EmailMultiAlternatives(subject=message['subject'], body=message['body'],
+                                   from_email=settings.EMAIL_HOST_USER, to=[message['to']], connection=connection)
+    if message.get('html'):
+        email.attach_alternative(message['html'], 'text/html')
+    return email
+
+
+def is_connection_error(error):
+    """
+    Ошибки SMTP по конкретному письму (отказ получателя, данных) не требуют переподключения,
+    остальные (обрыв, таймаут, TLS) означают, что соединение потеряно
+    """
+    return not isinstance(error, smtplib.SMTPException) or isinstance(error, smtplib.SMTPServerDisconnected)
+
+
+def send_batch(messages, connection=None):
+    """
+    Отправляет пачку писем через одно SMTP-соединение. Возвращает письма, которые не удалось отправить;
+    при обрыве соединение открывается заново для оставшихся писем
+    """
+    connection = connection or get_connection()
+    failed = []
+    try:
+        connection.open()
+        for position, message in enumerate(messages):
+            try:
+                build_email(message, connection).send()
+            except OSError as error:
+                logger.warning('Не удалось отправить письмо %s: %s', message['to'], error)
+                failed.append(message)
+                if is_connection_error(error):
+                    connection.close()
+                    try:
+                        connection.open()
+                    except OSError:
+                        # сервер недоступен: остаток пачки уходит на повтор целиком
+                        failed.extend(messages[position + 1:])
+                        break
+    except OSError as error:
+        logger.warning('SMTP-сервер недоступен: %s', error)
+        return list(messages)
+    finally:
+        connection.close()
+    return failed
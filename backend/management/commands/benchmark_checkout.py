@@ -0,0 +1,66 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from backend.checkout import checkout, CheckoutError
+from backend.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность одновременных оформлений заказов на одном "горячем" товаре. '
+            'Создает временные данные и удаляет их после замера, запускать на тестовой базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help='Число корзин')
+        parser.add_argument('--workers', type=int, default=8, help='Число параллельных потоков')
+        parser.add_argument('--stock', type=int, default=None, help='Остаток товара, по умолчанию половина корзин')
+
+    def handle(self, *args, **options):
+        orders, workers = options['orders'], options['workers']
+        stock = options['stock'] if options['stock'] is not None else orders // 2
+        prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+
+        shop = Shop.objects.create(name=prefix[:50], state=True)
+        try:
+            category, _ = Category.objects.get_or_create(name=prefix)
+            hot = ProductInfo.objects.create(product=Product.objects.create(name=prefix, category=category),
+                                             shop=shop, external_id=0, model=prefix, quantity=stock,
+                                             price=1000, price_rrc=1000)
+            users = User.objects.bulk_create([User(email=f'{prefix}-{i}@example.com', username=f'{prefix}-{i}')
+                                              for i in range(orders)])
+            contacts = Contact.objects.bulk_create([
+                Contact(user=user, zip=101000, country='Россия', city='Москва', street='Тверская',
+                        phone='+70000000000') for user in users])
+            baskets = Order.objects.bulk_create([Order(user=user, state='basket') for user in users])
+            OrderItem.objects.bulk_create([OrderItem(order=basket, product_info=hot, shop=shop, quantity=1,
+                                                     price=hot.price) for basket in baskets])
+
+            def place(args):
+                try:
+                    checkout(*args)
+                    return True
+                except CheckoutError:
+                    return False
+                finally:
+                    connection.close()
+
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                placed = sum(executor.map(place, [(user.id, basket.id, contact.id)
+                                                  for user, basket, contact in zip(users, baskets, contacts)]))
+            elapsed = time.monotonic() - started
+
+            hot.refresh_from_db()
+            self.stdout.write(f'Оформлений: {orders} за {elapsed:.2f} с ({orders / elapsed:.1f} в секунду), '
+                              f'потоков: {workers}')
+            self.stdout.write(f'Оформлено: {placed}, отказано: {orders - placed}, остаток: {hot.quantity}')
+            if placed > stock or hot.quantity != stock - placed:
+                self.stderr.write('Продано больше остатка')
+        finally:
+            User.objects.filter(email__startswith=prefix).delete()
+            shop.delete()
+            Product.objects.filter(name=prefix).delete()
+            Category.objects.filter(name=prefix).delete()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест HTTP: заданное число keep-alive соединений на каждый URL, выводит запросы в секунду '
+            'и задержки. Для сравнения WSGI и ASGI запускать против gunicorn orders.wsgi и '
+            'uvicorn orders.asgi:application с одинаковым числом процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Полные URL, например http://localhost:8000/api/v1/shops')
+        parser.add_argument('--connections', type=int, default=50, help='Одновременных соединений')
+        parser.add_argument('--duration', type=float, default=10, help='Длительность замера в секундах')
+        parser.add_argument('--token', default='', help='Токен пользователя для корзины и заказов')
+
+    def handle(self, *args, **options):
+        for url in options['urls']:
+            latencies, errors, elapsed = asyncio.run(self.load(url, options))
+            latencies.sort()
+            if not latencies:
+                self.stdout.write(f'{url}: нет успешных ответов, ошибок: {errors}')
+                continue
+            self.stdout.write(
+                f'{url}: {len(latencies) / elapsed:.1f} запросов в секунду, соединений {options["connections"]}, '
+                f'p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, '
+                f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс, ошибок: {errors}')
+
+    async def load(self, url, options):
+        parts = urlsplit(url)
+        target = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                   + (f'Authorization: Token {options["token"]}\r\n' if options['token'] else '')
+                   + '\r\n').encode()
+        latencies, errors = [], [0]
+        deadline = time.perf_counter() + options['duration']
+
+        async def connection():
+            reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    writer.write(request)
+                    status = (await reader.readline()).split()[1]
+                    length = 0
+                    while (line := await reader.readline()) != b'\r\n':
+                        name, _, value = line.partition(b':')
+                        if name.lower() == b'content-length':
+                            length = int(value)
+                    await reader.readexactly(length)
+                    if status == b'200':
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors[0] += 1
+            finally:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(options['connections'])))
+        return latencies, errors[0], time.perf_counter() - started
@@ -0,0 +1,40 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from backend.mail import build_messages, send_batch
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает отправку писем с соединением на каждое письмо и пачками через одно соединение. '
+            'Запускать против локальной заглушки SMTP, например: python -m aiosmtpd -n -l localhost:8025')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--ssl', action='store_true', help='Подключаться по SMTP over SSL')
+        parser.add_argument('--messages', type=int, default=500, help='Число писем')
+        parser.add_argument('--batch', type=int, default=100, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        messages = build_messages('Обновление статуса заказа', 'Заказ сформирован',
+                                  [f'benchmark{i}@example.com' for i in range(options['messages'])])
+
+        def connection():
+            return get_connection('django.core.mail.backends.smtp.EmailBackend', host=options['host'],
+                                  port=options['port'], use_ssl=options['ssl'], use_tls=False,
+                                  username='', password='')
+
+        started = time.perf_counter()
+        failed = sum(len(send_batch([message], connection())) for message in messages)
+        self.report('соединение на письмо', len(messages), failed, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        failed = sum(len(send_batch(messages[position:position + options['batch']], connection()))
+                     for position in range(0, len(messages), options['batch']))
+        self.report(f'пачки по {options["batch"]}', len(messages), failed, time.perf_counter() - started)
+
+    def report(self, mode, count, failed, elapsed):
+        self.stdout.write(f'{mode}: {count} писем за {elapsed:.2f} с ({count / elapsed:.1f} в секунду), '
+                          f'ошибок: {failed}')
@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from backend.models import ProductInfo, ProductParameter, Order, OrderItem
+from backend.renderers import UJSONRenderer
+from backend.serializers import ProductInfoSerializer, OrderSerializer, OrderSummarySerializer, \
+    ORDER_SUMMARY_FIELDS, serialize_product_infos, serialize_orders, serialize_order_summaries
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стоимость строки ответа для сериализаторов DRF и быстрых сериализаторов на values(), '
+            'а также рендеринг JSONRenderer и UJSONRenderer, на данных из базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Число позиций каталога и заказов')
+        parser.add_argument('--repeat', type=int, default=20, help='Число повторов замера')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        product_info_ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True)[:rows])
+        order_ids = list(Order.objects.exclude(state='basket').values_list('id', flat=True)[:rows])
+        parameters = Prefetch('product_parameters', queryset=ProductParameter.objects.order_by('id').select_related(
+            'parameter'))
+
+        def product_infos_drf():
+            return ProductInfoSerializer(ProductInfo.objects.filter(id__in=product_info_ids).order_by(
+                'id').select_related('product__category').prefetch_related(parameters), many=True).data
+
+        def product_infos_fast():
+            data = serialize_product_infos(product_info_ids)
+            return [data[product_info_id] for product_info_id in product_info_ids]
+
+        orders = Order.objects.filter(id__in=order_ids)
+
+        def orders_drf():
+            return OrderSerializer(orders.select_related('contact').prefetch_related(
+                Prefetch('ordered_items', queryset=OrderItem.objects.order_by('id')),
+                'ordered_items__product_info__product__category',
+                Prefetch('ordered_items__product_info__product_parameters',
+                         queryset=ProductParameter.objects.order_by('id').select_related('parameter'))),
+                many=True).data
+
+        def summaries_drf():
+            return OrderSummarySerializer(orders.select_related('contact'), many=True).data
+
+        def summaries_fast():
+            return serialize_order_summaries(orders.values(*ORDER_SUMMARY_FIELDS))
+
+        for name, count, drf, fast in (
+                ('ProductInfoSerializer', len(product_info_ids), product_infos_drf, product_infos_fast),
+                ('OrderSerializer', len(order_ids), orders_drf, lambda: serialize_orders(orders)),
+                ('OrderSummarySerializer', len(order_ids), summaries_drf, summaries_fast)):
+            if not count:
+                self.stdout.write(f'{name}: нет данных')
+                continue
+            self.report(name, 'DRF', count, repeat, drf)
+            self.report(name, 'values()', count, repeat, fast)
+
+            data = drf()
+            rendered = set()
+            for renderer in (JSONRenderer(), UJSONRenderer()):
+                rendered.add(renderer.render(data))
+                self.report(name, type(renderer).__name__, count, repeat, lambda: renderer.render(data))
+            rendered.add(UJSONRenderer().render(fast()))
+            if len(rendered) != 1:
+                self.stderr.write(f'{name}: вывод отличается')
+
+    def report(self, name, stage, count, repeat, func):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = (time.perf_counter() - started) / repeat
+        self.stdout.write(f'{name}, {stage}: {elapsed * 1000:.2f} мс на {count} строк, '
+                          f'{elapsed / count * 1e6:.1f} мкс на строку')
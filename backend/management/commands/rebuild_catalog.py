@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from backend.catalog import refresh_catalog
+from backend.models import ProductInfo
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересобирает витрину каталога CatalogItem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, help='ИД магазина, по умолчанию все магазины')
+
+    def handle(self, *args, **options):
+        product_infos = ProductInfo.objects.all()
+        if options['shop']:
+            product_infos = product_infos.filter(shop_id=options['shop'])
+        refreshed = refresh_catalog(product_infos)
+        self.stdout.write(f'Обновлено позиций витрины: {refreshed}')
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backend.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = ('Отправляет в Celery задачи, записанные в outbox вместе с заказами и регистрациями. '
+            'Работает постоянно отдельным процессом рядом с воркерами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь один раз и выйти')
+        parser.add_argument('--batch', type=int, default=settings.OUTBOX_BATCH_SIZE, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = relay_outbox(options['batch'])
+            if sent:
+                self.stdout.write(f'Отправлено событий: {sent}')
+            # полная пачка - в очереди, скорее всего, есть еще события
+            if sent == options['batch']:
+                continue
+            if options['once']:
+                return
+            time.sleep(settings.OUTBOX_POLL_INTERVAL)
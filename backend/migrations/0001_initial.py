@@ -0,0 +1,301 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:51
+
+import backend.models
+from django.conf import settings
+import django.contrib.auth.validators
+import django.contrib.postgres.operations
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='email address')),
+                ('company', models.CharField(blank=True, max_length=40, verbose_name='Компания')),
+                ('position', models.CharField(blank=True, max_length=40, verbose_name='Должность')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('is_active', models.BooleanField(default=False, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('type', models.CharField(choices=[('shop', 'Продавец'), ('buyer', 'Покупатель')], default='buyer', max_length=5, verbose_name='Тип пользователя')),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'Пользователь',
+                'verbose_name_plural': 'Список пользователей',
+                'ordering': ('email',),
+            },
+            managers=[
+                ('objects', backend.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=40, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Категория',
+                'verbose_name_plural': 'Список категорий',
+                'ordering': ('-name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Contact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zip', models.IntegerField(verbose_name='Почтовый индекс')),
+                ('country', models.CharField(max_length=64, verbose_name='Страна')),
+                ('city', models.CharField(max_length=50, verbose_name='Город')),
+                ('street', models.CharField(max_length=100, verbose_name='Улица')),
+                ('house', models.CharField(blank=True, max_length=15, verbose_name='Дом')),
+                ('structure', models.CharField(blank=True, max_length=15, verbose_name='Корпус')),
+                ('building', models.CharField(blank=True, max_length=15, verbose_name='Строение')),
+                ('apartment', models.CharField(blank=True, max_length=15, verbose_name='Квартира')),
+                ('phone', models.CharField(max_length=20, verbose_name='Телефон')),
+                ('user', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='contacts', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Контакты пользователя',
+                'verbose_name_plural': 'Список контактов пользователя',
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt', models.DateTimeField(auto_now_add=True)),
+                ('state', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=15, verbose_name='Статус')),
+                ('contact', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='backend.contact', verbose_name='Контакт')),
+                ('user', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Заказ',
+                'verbose_name_plural': 'Список заказ',
+                'ordering': ('-dt',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Parameter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=40, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Имя параметра',
+                'verbose_name_plural': 'Список имен параметров',
+                'ordering': ('-name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=80, verbose_name='Название')),
+                ('category', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='backend.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Продукт',
+                'verbose_name_plural': 'Список продуктов',
+                'ordering': ('-name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=60, verbose_name='Название')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('external_id', models.PositiveIntegerField(verbose_name='Внешний ИД')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('product', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_infos', to='backend.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Информация о продукте',
+                'verbose_name_plural': 'Информационный список о продуктах',
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogItem',
+            fields=[
+                ('product_info', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_item', serialize=False, to='backend.productinfo', verbose_name='Информация о продукте')),
+                ('shop_state', models.BooleanField(verbose_name='статус получения заказов')),
+                ('product_name', models.CharField(max_length=80, verbose_name='Название')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('parameters', models.JSONField(default=dict, verbose_name='Параметры')),
+                ('data', models.JSONField(verbose_name='Представление')),
+                ('search_text', models.TextField(blank=True, verbose_name='Текст для поиска')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True, verbose_name='Поисковый вектор')),
+            ],
+            options={
+                'verbose_name': 'Позиция каталога',
+                'verbose_name_plural': 'Витрина каталога',
+            },
+        ),
+        migrations.CreateModel(
+            name='Shop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='Название')),
+                ('url', models.URLField(blank=True, null=True, verbose_name='Ссылка')),
+                ('state', models.BooleanField(default=True, verbose_name='статус получения заказов')),
+                ('price_etag', models.CharField(blank=True, max_length=255, verbose_name='ETag прайса')),
+                ('price_last_modified', models.CharField(blank=True, max_length=64, verbose_name='Last-Modified прайса')),
+                ('price_hash', models.CharField(blank=True, max_length=64, verbose_name='SHA-256 прайса')),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Магазин',
+                'verbose_name_plural': 'Магазины',
+                'ordering': ('-name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductParameter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('parameter', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_parameters', to='backend.parameter', verbose_name='Параметр')),
+                ('product_info', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_parameters', to='backend.productinfo', verbose_name='Информация о продукте')),
+            ],
+            options={
+                'verbose_name': 'Параметр',
+                'verbose_name_plural': 'Список параметров',
+            },
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='shop',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_infos', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('order', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='ordered_items', to='backend.order', verbose_name='Заказ')),
+                ('product_info', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='ordered_items', to='backend.productinfo', verbose_name='Информация о продукте')),
+                ('shop', models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказанная позиция',
+                'verbose_name_plural': 'Список заказанных позиций',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(verbose_name='Ссылка на прайс')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('task_id', models.CharField(blank=True, max_length=255, verbose_name='ИД задачи')),
+                ('chunks', models.PositiveIntegerField(default=0, verbose_name='Пачек')),
+                ('chunks_done', models.PositiveIntegerField(default=0, verbose_name='Обработано пачек')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Позиций')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Добавлено')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Изменено')),
+                ('deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено')),
+                ('unchanged', models.PositiveIntegerField(default=0, verbose_name='Без изменений')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Импорт прайса',
+                'verbose_name_plural': 'Список импортов прайсов',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ConfirmEmailToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='When was this token generated')),
+                ('key', models.CharField(db_index=True, max_length=64, unique=True, verbose_name='Key')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='confirm_email_tokens', to=settings.AUTH_USER_MODEL, verbose_name='The User which is associated to this password reset token')),
+            ],
+            options={
+                'verbose_name': 'Токен подтверждения Email',
+                'verbose_name_plural': 'Токены подтверждения Email',
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='shops',
+            field=models.ManyToManyField(blank=True, related_name='categories', to='backend.shop', verbose_name='Магазины'),
+        ),
+        migrations.AddConstraint(
+            model_name='productparameter',
+            constraint=models.UniqueConstraint(fields=('product_info', 'parameter'), name='unique_product_parameter'),
+        ),
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(fields=('product', 'shop', 'external_id'), name='unique_product_info'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order_id', 'product_info'), name='unique_order_item'),
+        ),
+        migrations.AddConstraint(
+            model_name='importjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('state__in', ('pending', 'running'))), fields=('user',), name='unique_active_import_job'),
+        ),
+        migrations.AddField(
+            model_name='catalogitem',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_items', to='backend.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='catalogitem',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_items', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['shop_state', 'product_info'], name='catalog_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['shop', 'product_info'], name='catalog_shop_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['category', 'product_info'], name='catalog_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='catalog_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='catalog_trigram_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:54
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, PositiveIntegerField, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    """
+    Фиксирует в имеющихся позициях текущие цены и считает по ним суммы заказов
+    """
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    Order = apps.get_model('backend', 'Order')
+
+    OrderItem.objects.update(price=Subquery(
+        ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('price')[:1]))
+    items_total = OrderItem.objects.filter(order_id=OuterRef('pk')).values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'))).values('total')
+    Order.objects.update(total=Coalesce(Subquery(items_total, output_field=PositiveIntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(default=0, verbose_name='Цена'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
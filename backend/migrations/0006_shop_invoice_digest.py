@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_order_item_shop_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='invoice_digest',
+            field=models.BooleanField(default=False, verbose_name='сводка накладных'),
+        ),
+    ]
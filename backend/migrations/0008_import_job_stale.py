@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='stale',
+            field=models.JSONField(blank=True, default=list, verbose_name='Удаляемые позиции'),
+        ),
+    ]
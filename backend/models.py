@@ -1,7 +1,10 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -15,6 +18,16 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
+# состояния незавершенного импорта, одновременно у магазина может быть только один такой
+IMPORT_ACTIVE_STATES = ('pending', 'running')
+
 USER_TYPE_CHOICES = (
     ('shop', 'Продавец'),
     ('buyer', 'Покупатель'),
@@ -103,6 +116,12 @@ class Shop(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    # данные последнего загруженного прайса для условных запросов
+    price_etag = models.CharField(verbose_name='ETag прайса', max_length=255, blank=True)
+    price_last_modified = models.CharField(verbose_name='Last-Modified прайса', max_length=64, blank=True)
+    price_hash = models.CharField(verbose_name='SHA-256 прайса', max_length=64, blank=True)
+    # накладные копятся и приходят одним письмом раз в INVOICE_DIGEST_INTERVAL
+    invoice_digest = models.BooleanField(verbose_name='сводка накладных', default=False)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -158,6 +177,10 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'product'], name='product_info_shop_idx'),
+            models.Index(fields=['shop', 'external_id'], name='product_info_external_idx'),
+        ]
 
 
 class Parameter(models.Model):
@@ -188,6 +211,41 @@ class ProductParameter(models.Model):
         ]
 
 
+class CatalogItem(models.Model):
+    """
+    Денормализованная витрина каталога: одна строка на предложение магазина
+    с готовым представлением для выдачи
+    """
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте',
+                                        related_name='catalog_item', primary_key=True,
+                                        on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_items',
+                             on_delete=models.CASCADE)
+    shop_state = models.BooleanField(verbose_name='статус получения заказов')
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_items',
+                                 on_delete=models.CASCADE)
+    product_name = models.CharField(max_length=80, verbose_name='Название')
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    parameters = models.JSONField(verbose_name='Параметры', default=dict)
+    data = models.JSONField(verbose_name='Представление')
+    # название, модель и значения параметров одной строкой для нечеткого поиска
+    search_text = models.TextField(verbose_name='Текст для поиска', blank=True)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор', null=True)
+
+    class Meta:
+        verbose_name = 'Позиция каталога'
+        verbose_name_plural = "Витрина каталога"
+        indexes = [
+            models.Index(fields=['shop_state', 'product_info'], name='catalog_state_idx'),
+            models.Index(fields=['shop', 'product_info'], name='catalog_shop_idx'),
+            models.Index(fields=['category', 'product_info'], name='catalog_category_idx'),
+            GinIndex(fields=['search_vector'], name='catalog_search_idx'),
+            # требует расширения pg_trgm
+            GinIndex(fields=['search_text'], name='catalog_trigram_idx', opclasses=['gin_trgm_ops']),
+        ]
+
+
 class Contact(models.Model):
     user = models.ForeignKey(User, verbose_name='Пользователь',
                              related_name='contacts', blank=True,
@@ -219,15 +277,30 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # сумма по ценам, зафиксированным в позициях, пересчитывается при каждом изменении состава заказа
+    total = models.PositiveIntegerField(verbose_name='Сумма', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказ"
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['user', 'state'], name='order_user_state_idx'),
+            models.Index(fields=['user', '-dt'], name='order_user_dt_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
 
+    def update_total(self):
+        """
+        Пересчитывает сумму заказа одним UPDATE с подзапросом по его позициям
+        """
+        items_total = OrderItem.objects.filter(order_id=models.OuterRef('pk')).values('order_id').annotate(
+            total=models.Sum(models.F('quantity') * models.F('price'))).values('total')
+        Order.objects.filter(id=self.id).update(
+            total=Coalesce(models.Subquery(items_total, output_field=models.PositiveIntegerField()), 0))
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, verbose_name='Заказ', related_name='ordered_items', blank=True,
@@ -239,6 +312,8 @@ class OrderItem(models.Model):
     shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='order_items', blank=True,
                              on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # цена на момент добавления в корзину, при оформлении заказа обновляется и дальше не меняется
+    price = models.PositiveIntegerField(verbose_name='Цена', default=0)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -246,6 +321,65 @@ class OrderItem(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['order_id', 'product_info'], name='unique_order_item'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'order'], name='order_item_shop_idx'),
+        ]
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_jobs',
+                             blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка на прайс')
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=10, default='pending')
+    task_id = models.CharField(verbose_name='ИД задачи', max_length=255, blank=True)
+    chunks = models.PositiveIntegerField(verbose_name='Пачек', default=0)
+    chunks_done = models.PositiveIntegerField(verbose_name='Обработано пачек', default=0)
+    rows = models.PositiveIntegerField(verbose_name='Позиций', default=0)
+    created = models.PositiveIntegerField(verbose_name='Добавлено', default=0)
+    updated = models.PositiveIntegerField(verbose_name='Изменено', default=0)
+    deleted = models.PositiveIntegerField(verbose_name='Удалено', default=0)
+    unchanged = models.PositiveIntegerField(verbose_name='Без изменений', default=0)
+    # ИД позиций, пропавших из прайса; удаляются после записи всех пачек
+    stale = models.JSONField(verbose_name='Удаляемые позиции', default=list, blank=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Импорт прайса'
+        verbose_name_plural = "Список импортов прайсов"
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(state__in=IMPORT_ACTIVE_STATES),
+                                    name='unique_active_import_job'),
+        ]
+
+    def __str__(self):
+        return f'{self.url} ({self.state})'
+
+
+class OutboxEvent(models.Model):
+    """
+    Задача Celery, записанная в одной транзакции с изменением данных;
+    в брокер ее отправляет relay_outbox после коммита
+    """
+    task = models.CharField(verbose_name='Задача', max_length=255)
+    kwargs = models.JSONField(verbose_name='Аргументы', default=dict)
+    attempts = models.PositiveIntegerField(verbose_name='Попыток отправки', default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Событие для отправки'
+        verbose_name_plural = 'Очередь событий для отправки'
+        ordering = ('id',)
+
+    def __str__(self):
+        return f'{self.task} {self.kwargs}'
 
 
 class ConfirmEmailToken(models.Model):
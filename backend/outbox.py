@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from kombu.exceptions import OperationalError
+
+from backend.models import OutboxEvent
+from orders.celery import celery_app
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, **kwargs):
+    """
+    Записывает задачу в outbox. Вызывается внутри транзакции, меняющей данные:
+    задача уйдет в брокер только если транзакция зафиксирована
+    """
+    return OutboxEvent.objects.create(task=task, kwargs=kwargs)
+
+
+def relay_outbox(batch_size=None):
+    """
+    Отправляет в брокер пачку событий через одно соединение и удаляет отправленные.
+    Строки берутся с SKIP LOCKED, поэтому параллельные relay не отправляют одно событие дважды;
+    при сбое брокера неотправленные события остаются в таблице до следующего прохода.
+    Возвращает число отправленных событий
+    """
+    with transaction.atomic():
+        events = list(OutboxEvent.objects.select_for_update(skip_locked=True).order_by('id')[
+                      :batch_size or settings.OUTBOX_BATCH_SIZE])
+        sent = []
+        try:
+            with celery_app.producer_or_acquire() as producer:
+                for event in events:
+                    celery_app.send_task(event.task, kwargs=event.kwargs, task_id=f'outbox-{event.id}',
+                                         producer=producer)
+                    sent.append(event.id)
+        except OperationalError as error:
+            logger.warning('Брокер недоступен, отправлено событий %s из %s: %s', len(sent), len(events), error)
+            OutboxEvent.objects.filter(id=events[len(sent)].id).update(attempts=F('attempts') + 1)
+        OutboxEvent.objects.filter(id__in=sent).delete()
+    return len(sent)
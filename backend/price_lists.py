@@ -0,0 +1,182 @@
+import csv
+import hashlib
+import io
+import tempfile
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from yaml import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, \
+    MappingEndEvent, ScalarNode, SequenceNode, MappingNode
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# колонки csv-прайса, все остальные колонки считаются параметрами товара
+CSV_COLUMNS = ('shop', 'category', 'category_name', 'id', 'model', 'name', 'price', 'price_rrc', 'quantity')
+
+
+def download(url, etag='', last_modified=''):
+    """
+    Скачивает прайс частями во временный файл, попутно считая SHA-256.
+    Возвращает файл, заголовки ответа и хэш; если сервер ответил 304, файла и хэша нет
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    file = tempfile.TemporaryFile()
+    digest = hashlib.sha256()
+    try:
+        with requests.get(url, headers=headers, stream=True, timeout=settings.IMPORT_TIMEOUT) as response:
+            if response.status_code == requests.codes.not_modified:
+                file.close()
+                return None, response.headers, None
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=settings.IMPORT_CHUNK_SIZE):
+                digest.update(chunk)
+                file.write(chunk)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file, response.headers, digest.hexdigest()
+
+
+def price_list_format(url, content_type=''):
+    """
+    Определяет формат прайса по расширению ссылки или Content-Type.
+    JSON является подмножеством YAML и читается тем же потоковым парсером
+    """
+    if urlparse(url).path.lower().endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return 'yaml'
+
+
+def read_price_list(file, price_format):
+    """
+    Потоково читает прайс и отдает записи ('shop', название), ('category', {...}) и ('good', {...}).
+    Первой всегда идет запись о магазине
+    """
+    if price_format == 'csv':
+        return read_csv(file)
+    return read_yaml(file)
+
+
+def read_yaml(file):
+    """
+    Разбирает yaml/json по событиям парсера: в памяти одновременно находится
+    только один элемент goods. Записи до ключа shop копятся, но не больше IMPORT_MAX_PENDING,
+    якорей yaml допускается не больше IMPORT_MAX_ANCHORS
+    """
+    loader = SafeLoader(file)
+    anchors = {}
+    # пока магазин не встретился, записи копятся, чтобы отдать его первым
+    pending = []
+    shop = None
+    try:
+        loader.get_event()  # StreamStartEvent
+        loader.get_event()  # DocumentStartEvent
+        if not loader.check_event(MappingStartEvent):
+            raise ValueError('Неверный формат прайса')
+        loader.get_event()
+
+        while not loader.check_event(MappingEndEvent):
+            key = loader.construct_document(compose_node(loader, anchors))
+            if key in ('categories', 'goods') and loader.check_event(SequenceStartEvent):
+                kind = 'category' if key == 'categories' else 'good'
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    record = (kind, loader.construct_document(compose_node(loader, anchors)))
+                    if shop is None:
+                        if len(pending) >= settings.IMPORT_MAX_PENDING:
+                            raise ValueError('Ключ shop должен идти в прайсе раньше goods')
+                        pending.append(record)
+                    else:
+                        yield record
+                loader.get_event()
+                continue
+
+            value = loader.construct_document(compose_node(loader, anchors))
+            if key == 'shop' and shop is None:
+                shop = value
+                yield 'shop', shop
+                yield from pending
+                pending.clear()
+    finally:
+        loader.dispose()
+
+    if shop is None:
+        raise ValueError('В прайсе не указан магазин')
+
+
+def compose_node(loader, anchors):
+    """
+    Собирает узел yaml из событий парсера, аналог Composer.compose_node
+    """
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        return anchors[event.anchor]
+
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(MappingEndEvent):
+            node.value.append((compose_node(loader, anchors), compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise ValueError(f'Неожиданное событие yaml: {event}')
+
+    if event.anchor is not None:
+        if event.anchor not in anchors and len(anchors) >= settings.IMPORT_MAX_ANCHORS:
+            raise ValueError('Слишком много якорей yaml в прайсе')
+        anchors[event.anchor] = node
+    return node
+
+
+def read_csv(file):
+    """
+    Построчно читает csv-прайс: одна строка - одна позиция
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f'В прайсе нет колонок: {", ".join(sorted(missing))}')
+
+    shop = None
+    categories = set()
+    for row in reader:
+        if shop is None:
+            shop = row['shop']
+            yield 'shop', shop
+        if row['category'] not in categories:
+            categories.add(row['category'])
+            yield 'category', {'id': row['category'], 'name': row['category_name']}
+        yield 'good', {
+            'id': row['id'], 'category': row['category'], 'model': row['model'], 'name': row['name'],
+            'price': row['price'], 'price_rrc': row['price_rrc'], 'quantity': row['quantity'],
+            'parameters': {name: value for name, value in row.items()
+                           if name not in CSV_COLUMNS and value not in (None, '')},
+        }
+
+    if shop is None:
+        raise ValueError('Прайс пуст')
@@ -0,0 +1,41 @@
+import ujson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    JSON-ответы через ujson, вывод побайтно совпадает с JSONRenderer в компактном режиме.
+    Форматированный вывод (indent) отдается стандартному рендереру
+    """
+    encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = ujson.dumps(data, ensure_ascii=self.ensure_ascii, escape_forward_slashes=False,
+                          allow_nan=not self.strict, default=self.encoder.default)
+        # как в JSONRenderer: U+2028 и U+2029 допустимы в JSON, но не в JavaScript
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode()
+
+
+class UJSONParser(JSONParser):
+    """
+    Разбор JSON-запросов через ujson
+    """
+    renderer_class = UJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return ujson.loads(stream.read().decode(encoding))
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
+from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, \
+    ImportJob
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -63,11 +64,32 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class CatalogItemSerializer(serializers.BaseSerializer):
+    """
+    Отдает готовое представление ProductInfoSerializer из витрины каталога.
+    jsonb не хранит порядок ключей, поэтому он восстанавливается как у ProductInfoSerializer
+    """
+
+    def to_representation(self, instance):
+        data = instance.data
+        return {
+            'id': data['id'],
+            'model': data['model'],
+            'product': {'name': data['product']['name'], 'category': data['product']['category']},
+            'shop': data['shop'],
+            'quantity': data['quantity'],
+            'price': data['price'],
+            'price_rrc': data['price_rrc'],
+            'product_parameters': [{'parameter': parameter['parameter'], 'value': parameter['value']}
+                                   for parameter in data['product_parameters']],
+        }
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'order',)
-        read_only_fields = ('id',)
+        fields = ('id', 'product_info', 'quantity', 'price', 'order',)
+        read_only_fields = ('id', 'price',)
         extra_kwargs = {
             'order': {'write_only': True}
         }
@@ -80,10 +102,186 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
-    total_sum = serializers.IntegerField()
+    total_sum = serializers.IntegerField(source='total', read_only=True)
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
\ No newline at end of file
+        read_only_fields = ('id',)
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Краткое представление заказа для списков, без позиций
+    """
+    total_sum = serializers.IntegerField(source='total', read_only=True)
+    contact = ContactSerializer(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ('id', 'state', 'dt', 'total_sum', 'contact',)
+        read_only_fields = fields
+
+
+class PartnerOrderItemSerializer(serializers.ModelSerializer):
+    external_id = serializers.IntegerField(source='product_info.external_id', read_only=True)
+    model = serializers.CharField(source='product_info.model', read_only=True)
+    name = serializers.CharField(source='product_info.product.name', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'product_info', 'external_id', 'model', 'name', 'quantity', 'price',)
+        read_only_fields = fields
+
+
+class PartnerOrderSerializer(serializers.ModelSerializer):
+    """
+    Заказ глазами поставщика: только его позиции и их сумма
+    """
+    ordered_items = PartnerOrderItemSerializer(source='shop_items', read_only=True, many=True)
+    total_sum = serializers.IntegerField(source='shop_total', read_only=True)
+    contact = ContactSerializer(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ('id', 'state', 'dt', 'ordered_items', 'total_sum', 'contact',)
+        read_only_fields = fields
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'state', 'shop', 'chunks', 'chunks_done', 'rows', 'created', 'updated', 'deleted',
+                  'unchanged', 'error', 'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
+
+
+# Быстрые сериализаторы горячих списков: строятся из values() без экземпляров моделей
+# и полей DRF, вывод совпадает с соответствующими сериализаторами побайтно
+
+CONTACT_FIELDS = ('id', 'country', 'zip', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+ORDER_SUMMARY_FIELDS = ('id', 'state', 'dt', 'total', *[f'contact__{field}' for field in CONTACT_FIELDS])
+
+datetime_field = serializers.DateTimeField()
+
+
+PRODUCT_INFO_FIELDS = ('id', 'model', 'product__name', 'product__category__name', 'shop_id', 'quantity', 'price',
+                       'price_rrc')
+
+
+def product_info_queries(ids):
+    """
+    Запросы serialize_product_infos: позиции каталога и их параметры
+    """
+    return (ProductInfo.objects.filter(id__in=ids).order_by().values(*PRODUCT_INFO_FIELDS),
+            ProductParameter.objects.filter(product_info_id__in=ids).order_by('id').values_list(
+                'product_info_id', 'parameter__name', 'value'))
+
+
+def build_product_infos(rows, parameter_rows):
+    parameters = {}
+    for product_info_id, parameter, value in parameter_rows:
+        parameters.setdefault(product_info_id, []).append({'parameter': parameter, 'value': value})
+
+    return {
+        row['id']: {
+            'id': row['id'],
+            'model': row['model'],
+            'product': {'name': row['product__name'], 'category': row['product__category__name']},
+            'shop': row['shop_id'],
+            'quantity': row['quantity'],
+            'price': row['price'],
+            'price_rrc': row['price_rrc'],
+            'product_parameters': parameters.get(row['id'], []),
+        }
+        for row in rows
+    }
+
+
+def serialize_product_infos(ids):
+    """
+    ProductInfoSerializer(many=True).data для позиций с указанными ИД двумя запросами.
+    Возвращает {ИД: представление}
+    """
+    rows, parameter_rows = product_info_queries(ids)
+    return build_product_infos(rows, parameter_rows)
+
+
+async def aserialize_product_infos(ids):
+    rows, parameter_rows = product_info_queries(ids)
+    return build_product_infos([row async for row in rows], [row async for row in parameter_rows])
+
+
+def serialize_contact(row):
+    if row['contact__id'] is None:
+        return None
+    return {field: row[f'contact__{field}'] for field in CONTACT_FIELDS}
+
+
+def serialize_order_summaries(rows):
+    """
+    OrderSummarySerializer(many=True).data для строк values(*ORDER_SUMMARY_FIELDS)
+    """
+    return [
+        {
+            'id': row['id'],
+            'state': row['state'],
+            'dt': datetime_field.to_representation(row['dt']),
+            'total_sum': row['total'],
+            'contact': serialize_contact(row),
+        }
+        for row in rows
+    ]
+
+
+def order_item_rows(order_ids):
+    return OrderItem.objects.filter(order_id__in=order_ids).order_by('id').values(
+        'id', 'order_id', 'product_info_id', 'quantity', 'price')
+
+
+def group_order_items(item_rows):
+    items = {}
+    for item in item_rows:
+        items.setdefault(item['order_id'], []).append(item)
+    return items
+
+
+def build_orders(rows, items, product_infos):
+    return [
+        {
+            'id': row['id'],
+            'ordered_items': [
+                {'id': item['id'], 'product_info': product_infos[item['product_info_id']],
+                 'quantity': item['quantity'], 'price': item['price']}
+                for item in items.get(row['id'], [])
+            ],
+            'state': row['state'],
+            'dt': datetime_field.to_representation(row['dt']),
+            'total_sum': row['total'],
+            'contact': serialize_contact(row),
+        }
+        for row in rows
+    ]
+
+
+def serialize_orders(orders):
+    """
+    OrderSerializer(many=True).data для queryset заказов, без prefetch цепочки моделей
+    """
+    rows = list(orders.values(*ORDER_SUMMARY_FIELDS))
+    items = group_order_items(order_item_rows([row['id'] for row in rows]))
+    product_infos = serialize_product_infos({item['product_info_id'] for order_items in items.values()
+                                             for item in order_items})
+    return build_orders(rows, items, product_infos)
+
+
+async def aserialize_orders(orders):
+    """
+    serialize_orders через async ORM
+    """
+    rows = [row async for row in orders.values(*ORDER_SUMMARY_FIELDS)]
+    items = group_order_items([item async for item in order_item_rows([row['id'] for row in rows])])
+    product_infos = await aserialize_product_infos({item['product_info_id'] for order_items in items.values()
+                                                    for item in order_items})
+    return build_orders(rows, items, product_infos)
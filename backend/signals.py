@@ -1,8 +1,97 @@
+from functools import partial
+
 from celery import shared_task
-from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from backend.authentication import invalidate_user_tokens
+from backend.cache import bump_version, invalidate_user, invalidate_shop
+from backend.handlers import queue_email, refresh_shops
+from backend.models import ConfirmEmailToken, User, Shop, Category, Order, Product, ProductInfo
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    """
+    Сбрасываем кэш списка магазинов
+    """
+    bump_version('shops')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    """
+    Сбрасываем кэш списка категорий
+    """
+    bump_version('categories')
+
+
+# импорт пишет позиции, продукты и категории пакетно, без сигналов, и обновляет витрину сам;
+# сигналы переносят в витрину правки отдельных объектов, например, из админки
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved(sender, instance, **kwargs):
+    """
+    Обновляем позицию в витрине после коммита, когда видны и ее параметры
+    """
+    transaction.on_commit(partial(refresh_shops, ProductInfo.objects.filter(id=instance.id)))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """
+    Название и категория продукта хранятся в витрине у всех его позиций
+    """
+    transaction.on_commit(partial(refresh_shops, ProductInfo.objects.filter(product_id=instance.id)))
+
 
-from backend.models import ConfirmEmailToken, User
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    """
+    Название категории хранится в витрине у всех ее позиций
+    """
+    if not created:
+        transaction.on_commit(partial(refresh_shops, ProductInfo.objects.filter(product__category_id=instance.id)))
+
+
+@receiver(post_delete, sender=ProductInfo)
+def product_info_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Строка витрины удаляется каскадом, сбрасываем кэш магазина.
+    Удаление пачки позиций, продукта или категории сбрасывает кэш каждого магазина один раз
+    """
+    invalidated = vars(origin).setdefault('_invalidated_shops', set()) if origin is not None else set()
+    if instance.shop_id not in invalidated:
+        invalidated.add(instance.shop_id)
+        transaction.on_commit(partial(invalidate_shop, instance.shop_id))
+
+
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance, **kwargs):
+    """
+    Сбрасываем ETag корзины и заказов покупателя
+    """
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, **kwargs):
+    """
+    Сбрасываем кэш токена пользователя: смена пароля, is_active и данных профиля.
+    После коммита, иначе параллельный запрос успеет закэшировать старые данные
+    """
+    if not created:
+        transaction.on_commit(partial(invalidate_user_tokens, instance.id))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """
+    Выход или удаление пользователя: токен больше не принимается
+    """
+    # поля удаленного объекта Django обнуляет до коммита, поэтому значения связываются сразу
+    transaction.on_commit(partial(invalidate_user_tokens, instance.user_id))
 
 
 @shared_task(name="new_user_registered")
@@ -10,19 +99,8 @@ def new_user_registered(user_id):
     """
     Отправляем письмо с подтверждением почты
     """
-    token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user_id)
-
-    msg = EmailMultiAlternatives(
-        # title:
-        f"Password Reset Token for {token.user.email}",
-        # message:
-        token.key,
-        # from:
-        settings.EMAIL_HOST_USER,
-        # to:
-        [token.user.email]
-    )
-    msg.send()
+    token, _ = ConfirmEmailToken.objects.select_related('user').get_or_create(user_id=user_id)
+    queue_email(f"Password Reset Token for {token.user.email}", token.key, [token.user.email])
 
 
 @shared_task(name="new_order")
@@ -30,16 +108,5 @@ def new_order(user_id):
     """
     Отправляем письмо при изменении статуса заказа
     """
-    user = User.objects.get(id=user_id)
-
-    msg = EmailMultiAlternatives(
-        # title:
-        f"Обновление статуса заказа",
-        # message:
-        'Заказ сформирован',
-        # from:
-        settings.EMAIL_HOST_USER,
-        # to:
-        [user.email]
-    )
-    msg.send()
\ No newline at end of file
+    email = User.objects.filter(id=user_id).values_list('email', flat=True).get()
+    queue_email("Обновление статуса заказа", 'Заказ сформирован', [email])
@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import hashlib
+import smtplib
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+from unittest import skipUnless
+from unittest.mock import call, patch
 
-# Create your tests here.
\ No newline at end of file
+import yaml
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from kombu.exceptions import OperationalError
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from backend.cache import get_version, invalidate_shop
+from backend.catalog import refresh_catalog, set_shop_state
+from backend.checkout import checkout, CheckoutError
+from backend.handlers import dispatch_mail, send_invoices, send_invoice_digests, get_import, import_chunk, \
+    finish_import, refresh_stock
+from backend.mail import build_messages, send_batch
+from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, \
+    OrderItem, Contact, ConfirmEmailToken, CatalogItem, OutboxEvent, ImportJob
+from backend.outbox import enqueue, relay_outbox
+from backend.pagination import OrderCursorPagination
+from backend.price_lists import download, read_price_list
+from backend.renderers import UJSONRenderer, UJSONParser
+from backend.serializers import CatalogItemSerializer, ProductInfoSerializer, OrderSerializer, \
+    OrderSummarySerializer, ORDER_SUMMARY_FIELDS, serialize_orders, serialize_order_summaries
+from orders.celery import celery_app
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+PRICE_URL = 'https://example.com/shop1.yaml'
+
+
+class HotQueryFixture:
+    """
+    Покупатель с корзиной и заказами в разных статусах по товарам двух магазинов
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create_user('partner@example.com', 'password', type='shop', is_active=True)
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        cls.shop = Shop.objects.create(name='Связной', user=cls.partner)
+        other_shop = Shop.objects.create(name='Евросеть')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        color = Parameter.objects.create(name='Цвет')
+
+        products = Product.objects.bulk_create([Product(name=f'Смартфон {i}', category=category) for i in range(20)])
+        product_infos = ProductInfo.objects.bulk_create([
+            ProductInfo(product=product, shop=shop, external_id=i, model='apple/iphone', quantity=10,
+                        price=1000 + i, price_rrc=1100 + i)
+            for shop in (cls.shop, other_shop) for i, product in enumerate(products)
+        ])
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info=product_info, parameter=color, value='черный')
+            for product_info in product_infos
+        ])
+        refresh_catalog(ProductInfo.objects.all())
+
+        contact = Contact.objects.create(user=cls.buyer, zip=101000, country='Россия', city='Москва',
+                                         street='Тверская', phone='+70000000000')
+        for state in ('basket', 'new', 'confirmed', 'delivered'):
+            order = Order.objects.create(user=cls.buyer, state=state, contact=contact)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_info=product_info, shop_id=product_info.shop_id, quantity=1,
+                          price=product_info.price)
+                for product_info in product_infos[::5]
+            ])
+            order.update_total()
+        cls.confirm_token = ConfirmEmailToken.objects.create(user=cls.buyer)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user:
+            client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=user)[0].key)
+        return client
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются только в PostgreSQL')
+@override_settings(CACHES=LOCMEM_CACHE)
+class HotQueryPlanTests(HotQueryFixture, TestCase):
+    """
+    Горячие запросы API должны идти по индексам и укладываться в бюджет числа запросов
+    """
+
+    def assertIndexedQueries(self, queries, budget):
+        """
+        Проверяет число запросов и то, что ни один из них не требует последовательного чтения таблицы,
+        когда планировщику запрещен Seq Scan
+        """
+        self.assertLessEqual(len(queries), budget, '\n'.join(query['sql'] for query in queries))
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                for query in queries:
+                    if not query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                        continue
+                    cursor.execute('EXPLAIN ' + query['sql'])
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    self.assertNotIn('Seq Scan', plan, f'{query["sql"]}\n{plan}')
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+    def call(self, method, url, user=None, data=None):
+        client = self.get_client(user)
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(url, data)
+        self.assertLess(response.status_code, 400, response.content)
+        return context.captured_queries
+
+    def test_basket(self):
+        self.assertIndexedQueries(self.call('get', '/api/v1/basket', self.buyer), 8)
+
+    def test_orders(self):
+        self.assertIndexedQueries(self.call('get', '/api/v1/order', self.buyer), 3)
+        self.assertIndexedQueries(self.call('get', '/api/v1/order', self.buyer,
+                                            {'state': ['new', 'confirmed'], 'date_from': '2020-01-01'}), 3)
+
+    def test_order_detail(self):
+        order = Order.objects.get(user=self.buyer, state='new')
+        self.assertIndexedQueries(self.call('get', f'/api/v1/order/{order.id}', self.buyer), 8)
+
+    def test_partner_orders(self):
+        self.assertIndexedQueries(self.call('get', '/api/v1/partner/orders', self.partner), 5)
+
+    def test_products(self):
+        self.assertIndexedQueries(self.call('get', '/api/v1/products'), 1)
+        self.assertIndexedQueries(self.call('get', '/api/v1/products', data={'shop_id': self.shop.id}), 1)
+        self.assertIndexedQueries(self.call('get', '/api/v1/products', data={'category_id': 224}), 1)
+
+    def test_confirm_account(self):
+        queries = self.call('post', '/api/v1/user/register/confirm',
+                            data={'email': self.buyer.email, 'token': self.confirm_token.key})
+        self.assertIndexedQueries(queries, 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class HotQueryTests(HotQueryFixture, TestCase):
+    """
+    Ответы горячих запросов на данных HotQueryPlanTests, проверяются на любой базе
+    """
+
+    def test_order_history_filters(self):
+        client = self.get_client(self.buyer)
+        response = client.get('/api/v1/order', {'state': 'confirmed'})
+        self.assertEqual([order['state'] for order in response.json()['results']], ['confirmed'])
+        self.assertNotIn('ordered_items', response.json()['results'][0])
+
+        response = client.get('/api/v1/order', {'page_size': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(len(client.get(response.json()['next']).json()['results']), 1)
+
+        self.assertEqual(client.get('/api/v1/order', {'date_to': '2000-01-01'}).json()['results'], [])
+        self.assertEqual(client.get('/api/v1/order', {'state': 'unknown'}).status_code, 400)
+
+    def test_order_detail(self):
+        order = Order.objects.get(user=self.buyer, state='new')
+        response = self.get_client(self.buyer).get(f'/api/v1/order/{order.id}')
+        self.assertEqual((response.json()['id'], response.json()['state']), (order.id, 'new'))
+        self.assertEqual(len(response.json()['ordered_items']), 8)
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        self.assertEqual(self.get_client(self.buyer).get(f'/api/v1/order/{basket.id}').status_code, 404)
+
+    def test_partner_orders_contain_only_shop_lines(self):
+        response = self.get_client(self.partner).get('/api/v1/partner/orders')
+        orders = response.json()['results']
+        self.assertEqual([order['state'] for order in orders], ['delivered', 'confirmed', 'new'])
+        for order in orders:
+            items = OrderItem.objects.filter(order_id=order['id'], shop=self.shop)
+            self.assertEqual({item['id'] for item in order['ordered_items']}, {item.id for item in items})
+            self.assertEqual(order['total_sum'], sum(item.quantity * item.price for item in items))
+            self.assertLess(len(order['ordered_items']), OrderItem.objects.filter(order_id=order['id']).count())
+
+    def test_fast_serializers_match_drf(self):
+        orders = Order.objects.filter(user=self.buyer).select_related('contact').prefetch_related(
+            Prefetch('ordered_items', queryset=OrderItem.objects.order_by('id')),
+            'ordered_items__product_info__product__category',
+            Prefetch('ordered_items__product_info__product_parameters',
+                     queryset=ProductParameter.objects.order_by('id').select_related('parameter')))
+        renderer = UJSONRenderer()
+        self.assertEqual(renderer.render(serialize_orders(Order.objects.filter(user=self.buyer))),
+                         renderer.render(OrderSerializer(orders, many=True).data))
+        self.assertEqual(
+            renderer.render(serialize_order_summaries(Order.objects.filter(user=self.buyer).values(
+                *ORDER_SUMMARY_FIELDS))),
+            renderer.render(OrderSummarySerializer(orders, many=True).data))
+
+        product_infos = ProductInfo.objects.select_related('product__category').prefetch_related(
+            Prefetch('product_parameters', queryset=ProductParameter.objects.order_by('id').select_related(
+                'parameter'))).order_by('id')
+        catalog = CatalogItem.objects.order_by('product_info_id')
+        self.assertEqual(renderer.render(CatalogItemSerializer(catalog, many=True).data),
+                         renderer.render(ProductInfoSerializer(product_infos, many=True).data))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CatalogTests(TestCase):
+    """
+    Выдача каталога из витрины: фильтры, keyset-пагинация, поиск и фасеты
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = Shop.objects.create(name='Связной')
+        cls.other_shop = Shop.objects.create(name='Евросеть')
+        closed_shop = Shop.objects.create(name='Закрыт', state=False)
+        phones = Category.objects.create(id=224, name='Смартфоны')
+        accessories = Category.objects.create(id=15, name='Аксессуары')
+        color = Parameter.objects.create(name='Цвет')
+        rows = [(cls.shop, phones, 'Смартфон Apple iPhone XR', 'черный', 65000),
+                (cls.shop, phones, 'Смартфон Samsung Galaxy', 'белый', 40000),
+                (cls.shop, accessories, 'Чехол для iPhone', 'черный', 1000),
+                (cls.other_shop, phones, 'Смартфон Apple iPhone XR', 'красный', 63000),
+                (cls.other_shop, accessories, 'Кабель USB', 'белый', 500),
+                (closed_shop, phones, 'Смартфон Apple iPhone XS', 'черный', 90000)]
+        for i, (shop, category, name, value, price) in enumerate(rows):
+            product, _ = Product.objects.get_or_create(name=name, category=category)
+            product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=i, model='model',
+                                                      quantity=5, price=price, price_rrc=price)
+            ProductParameter.objects.create(product_info=product_info, parameter=color, value=value)
+        refresh_catalog(ProductInfo.objects.all())
+
+    def setUp(self):
+        cache.clear()
+
+    def products(self, **params):
+        response = self.client.get('/api/v1/products', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['product']['name'], item['shop']) for item in response.json()['results']]
+
+    def test_filters(self):
+        self.assertEqual(len(self.products()), 5)
+        self.assertEqual(len(self.products(shop_id=self.shop.id)), 3)
+        self.assertEqual(self.products(category_id=15, price_max=800), [('Кабель USB', self.other_shop.id)])
+        self.assertEqual(self.products(price_min=63000),
+                         [('Смартфон Apple iPhone XR', self.shop.id), ('Смартфон Apple iPhone XR', self.other_shop.id)])
+        self.assertEqual(self.products(search='Чехол'), [('Чехол для iPhone', self.shop.id)])
+        self.assertEqual(self.client.get('/api/v1/products', {'price_min': 'x'}).status_code, 400)
+
+    def test_refresh_catalog_upsert(self):
+        product_info = ProductInfo.objects.get(shop=self.shop, product__name='Смартфон Samsung Galaxy')
+        ProductInfo.objects.filter(id=product_info.id).update(price=39000)
+        ProductParameter.objects.filter(product_info=product_info).update(value='синий')
+        Category.objects.filter(id=224).update(name='Телефоны')
+        self.assertEqual(refresh_catalog(ProductInfo.objects.filter(id=product_info.id)), 1)
+
+        self.assertEqual(CatalogItem.objects.count(), 6)
+        item = CatalogItem.objects.get(product_info=product_info)
+        self.assertEqual((item.price, item.parameters, item.category_id), (39000, {'Цвет': 'синий'}, 224))
+        product_infos = ProductInfo.objects.filter(id=product_info.id).select_related(
+            'product__category').prefetch_related('product_parameters__parameter')
+        self.assertEqual(item.data, ProductInfoSerializer(product_infos, many=True).data[0])
+        self.assertEqual(item.data['product']['category'], 'Телефоны')
+
+        set_shop_state([self.shop.id], False)
+        self.assertEqual(len(self.client.get('/api/v1/products').json()['results']), 2)
+        product_info.delete()
+        self.assertFalse(CatalogItem.objects.filter(product_info_id=product_info.id).exists())
+
+    def test_model_edits_refresh_catalog(self):
+        product_info = ProductInfo.objects.get(shop=self.shop, product__name='Смартфон Samsung Galaxy')
+        versions = {shop.id: get_version(f'shop:{shop.id}') for shop in (self.shop, self.other_shop)}
+        with self.captureOnCommitCallbacks(execute=True):
+            product_info.price = 39000
+            product_info.save()
+            product_info.product.name = 'Смартфон Samsung Galaxy S'
+            product_info.product.save()
+            category = Category.objects.get(id=224)
+            category.name = 'Телефоны'
+            category.save()
+        item = CatalogItem.objects.get(product_info=product_info)
+        self.assertEqual((item.price, item.product_name, item.data['product']['category']),
+                         (39000, 'Смартфон Samsung Galaxy S', 'Телефоны'))
+        self.assertEqual(CatalogItem.objects.get(shop=self.other_shop, category_id=224).data['product']['category'],
+                         'Телефоны')
+        self.assertTrue(all(get_version(f'shop:{shop_id}') > version for shop_id, version in versions.items()))
+
+        # удаление нескольких позиций магазина сбрасывает его кэш один раз
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ProductInfo.objects.filter(shop=self.shop).delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(CatalogItem.objects.filter(shop=self.shop).exists())
+
+    def test_cache_scopes(self):
+        etags = {params: self.client.get('/api/v1/products', dict(params))['ETag']
+                 for params in ((), (('shop_id', self.shop.id),))}
+        with self.assertNumQueries(0):
+            for params, etag in etags.items():
+                self.assertEqual(self.client.get('/api/v1/products', dict(params), HTTP_IF_NONE_MATCH=etag).status_code,
+                                 304)
+
+        # изменения другого магазина сбрасывают общий каталог, но не выдачу по магазину
+        invalidate_shop(self.other_shop.id)
+        self.assertEqual(self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=etags[()]).status_code, 200)
+        self.assertEqual(self.client.get('/api/v1/products', {'shop_id': self.shop.id},
+                                         HTTP_IF_NONE_MATCH=etags[(('shop_id', self.shop.id),)]).status_code, 304)
+        invalidate_shop(self.shop.id)
+        self.assertEqual(self.client.get('/api/v1/products', {'shop_id': self.shop.id},
+                                         HTTP_IF_NONE_MATCH=etags[(('shop_id', self.shop.id),)]).status_code, 200)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Поиск по JSON-параметрам есть только в PostgreSQL')
+    def test_parameter_filter(self):
+        self.assertEqual(self.products(parameter='Цвет:белый', shop_id=self.shop.id),
+                         [('Смартфон Samsung Galaxy', self.shop.id)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый поиск есть только в PostgreSQL')
+    def test_search_and_facets(self):
+        response = self.client.get('/api/v1/products/search', {'q': 'iphone'}).json()
+        self.assertEqual(response['count'], 3)
+        self.assertEqual(sorted(item['product']['name'] for item in response['results']),
+                         ['Смартфон Apple iPhone XR', 'Смартфон Apple iPhone XR', 'Чехол для iPhone'])
+        self.assertEqual(response['facets']['shops'], [{'id': self.shop.id, 'name': 'Связной', 'count': 2},
+                                                       {'id': self.other_shop.id, 'name': 'Евросеть', 'count': 1}])
+        self.assertEqual(response['facets']['parameters'], {'Цвет': [{'value': 'черный', 'count': 2},
+                                                                     {'value': 'красный', 'count': 1}]})
+
+        response = self.client.get('/api/v1/products/search', {'q': 'iphone', 'category_id': 15}).json()
+        self.assertEqual([item['product']['name'] for item in response['results']], ['Чехол для iPhone'])
+        self.assertEqual(self.client.get('/api/v1/products/search').status_code, 400)
+
+    def test_cursor_pages(self):
+        response = self.client.get('/api/v1/products', {'page_size': 2}).json()
+        pages = [[item['id'] for item in response['results']]]
+        while response['next']:
+            response = self.client.get(response['next']).json()
+            pages.append([item['id'] for item in response['results']])
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), sorted(CatalogItem.objects.filter(shop_state=True).values_list(
+            'product_info_id', flat=True)))
+
+        previous = self.client.get(response['previous']).json()
+        self.assertEqual([item['id'] for item in previous['results']], pages[1])
+        self.assertEqual(len(self.client.get('/api/v1/products', {'page_size': 1000}).json()['results']), 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class OrderTotalTests(TestCase):
+    """
+    Сумма заказа хранится в самом заказе и считается по ценам, зафиксированным в позициях
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        shop = Shop.objects.create(name='Связной')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        cls.product_infos = [
+            ProductInfo.objects.create(product=Product.objects.create(name=f'Смартфон {i}', category=category),
+                                       shop=shop, external_id=i, model='apple/iphone', quantity=10,
+                                       price=price, price_rrc=price)
+            for i, price in enumerate((1000, 250))
+        ]
+        cls.contact = Contact.objects.create(user=cls.buyer, zip=101000, country='Россия', city='Москва',
+                                             street='Тверская', phone='+70000000000')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_total_follows_basket_and_stays_after_checkout(self):
+        first, second = self.product_infos
+        self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 2},
+                                                      {'product_info': second.id, 'quantity': 1}]}, format='json')
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        self.assertEqual(basket.total, 2250)
+
+        item = basket.ordered_items.get(product_info=second)
+        self.client.put('/api/v1/basket', {'items': [{'id': item.id, 'quantity': 4}]}, format='json')
+        basket.refresh_from_db()
+        self.assertEqual(basket.total, 3000)
+
+        response = self.client.put('/api/v1/basket', {'items': {'id': item.id, 'quantity': 5}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.delete('/api/v1/basket', {'items': str(item.id)})
+        basket.refresh_from_db()
+        self.assertEqual(basket.total, 2000)
+
+        ProductInfo.objects.filter(id=first.id).update(price=1500)
+        self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(self.contact.id)})
+        basket.refresh_from_db()
+        self.assertEqual(basket.total, 3000)
+
+        self.assertEqual(ProductInfo.objects.get(id=first.id).quantity, 8)
+        self.assertEqual(list(OutboxEvent.objects.values_list('task', 'kwargs')),
+                         [('backend.handlers.refresh_stock', {'product_info_ids': [first.id]}),
+                          ('new_order', {'user_id': self.buyer.id}),
+                          ('backend.handlers.send_invoices', {'order_id': basket.id})])
+
+        ProductInfo.objects.filter(id=first.id).update(price=500)
+        response = self.client.get('/api/v1/order')
+        self.assertEqual(response.json()['results'][0]['total_sum'], 3000)
+        response = self.client.get(f'/api/v1/order/{basket.id}')
+        self.assertEqual(response.json()['total_sum'], 3000)
+        self.assertEqual([item['price'] for item in response.json()['ordered_items']], [1500])
+
+    def test_basket_reports_bad_lines(self):
+        first, second = self.product_infos
+        response = self.client.post('/api/v1/basket', {'items': [
+            {'product_info': first.id, 'quantity': 2}, {'product_info': [first.id], 'quantity': 1},
+            {'product_info': {'id': second.id}, 'quantity': 1}, {'product_info': second.id, 'quantity': 0}]},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['Позиции'], [
+            {'product_info': first.id, 'Status': True},
+            {'product_info': [first.id], 'Status': False, 'Errors': 'Неверно указан товар'},
+            {'product_info': {'id': second.id}, 'Status': False, 'Errors': 'Неверно указан товар'},
+            {'product_info': second.id, 'Status': False, 'Errors': 'Неверно указано количество'}])
+
+        item = OrderItem.objects.get(order__user=self.buyer, order__state='basket')
+        response = self.client.put('/api/v1/basket', {'items': [
+            {'id': item.id, 'quantity': 3}, {'id': [item.id], 'quantity': 1}, {'id': item.id + 100, 'quantity': 1},
+            {'id': item.id, 'quantity': -1}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Позиции'], [
+            {'id': item.id, 'Status': True},
+            {'id': [item.id], 'Status': False, 'Errors': 'Неверно указана позиция'},
+            {'id': item.id + 100, 'Status': False, 'Errors': 'Позиция не найдена в корзине'},
+            {'id': item.id, 'Status': False, 'Errors': 'Неверно указано количество'}])
+        self.assertEqual(OrderItem.objects.get(id=item.id).quantity, 3)
+
+    def test_checkout_rejects_unavailable_items(self):
+        first, second = self.product_infos
+        self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 11},
+                                                      {'product_info': second.id, 'quantity': 1}]}, format='json')
+        basket = Order.objects.get(user=self.buyer, state='basket')
+
+        response = self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(self.contact.id)})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([error['product_info'] for error in response.json()['Errors']], [first.id])
+
+        Shop.objects.update(state=False)
+        self.client.put('/api/v1/basket', {'items': [{'id': basket.ordered_items.get(product_info=first).id,
+                                                      'quantity': 1}]}, format='json')
+        response = self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(self.contact.id)})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(response.json()['Errors']), 2)
+
+        basket.refresh_from_db()
+        self.assertEqual(basket.state, 'basket')
+        self.assertEqual(sorted(ProductInfo.objects.values_list('quantity', flat=True)), [10, 10])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_idempotent_retries(self):
+        first, _ = self.product_infos
+        items = {'items': [{'product_info': first.id, 'quantity': 2}]}
+        responses = [self.client.post('/api/v1/basket', items, format='json', HTTP_IDEMPOTENCY_KEY='basket-1')
+                     for _ in range(2)]
+        self.assertEqual(responses[0].content, responses[1].content)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+        response = self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 3}]},
+                                    format='json', HTTP_IDEMPOTENCY_KEY='basket-1')
+        self.assertEqual(response.status_code, 422)
+
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        data = {'id': str(basket.id), 'contact': str(self.contact.id)}
+        for _ in range(2):
+            response = self.client.post('/api/v1/order', data, HTTP_IDEMPOTENCY_KEY='order-1')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(OutboxEvent.objects.values_list('task', 'kwargs')),
+                         [('backend.handlers.refresh_stock', {'product_info_ids': [first.id]}),
+                          ('new_order', {'user_id': self.buyer.id}),
+                          ('backend.handlers.send_invoices', {'order_id': basket.id})])
+        self.assertEqual(ProductInfo.objects.get(id=first.id).quantity, 8)
+
+    def test_idempotency_lock_is_short(self):
+        first, _ = self.product_infos
+        with patch.object(cache, 'add', wraps=cache.add) as add, patch.object(cache, 'set', wraps=cache.set) as set_:
+            self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 1}]},
+                             format='json', HTTP_IDEMPOTENCY_KEY='basket-1')
+        timeouts = [(call.args[1] if isinstance(call.args[1], str) else 'response', call.args[2])
+                    for call in add.call_args_list + set_.call_args_list if call.args[0].startswith('idempotency:')]
+        self.assertEqual(timeouts, [('in_progress', settings.IDEMPOTENCY_LOCK_TIMEOUT),
+                                    ('response', settings.IDEMPOTENCY_TIMEOUT)])
+
+    def test_basket_etag_follows_changes(self):
+        first, _ = self.product_infos
+        self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 1}]}, format='json')
+        response = self.client.get('/api/v1/basket', HTTP_ACCEPT_ENCODING='gzip')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/basket', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/api/v1/basket', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 2}]}, format='json')
+        response = self.client.get('/api/v1/basket', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # в корзине текущие цена и остаток позиции, смена каталога магазина тоже меняет ETag
+        etag = response['ETag']
+        ProductInfo.objects.filter(id=first.id).update(price=1200)
+        invalidate_shop(first.shop_id)
+        response = self.client.get('/api/v1/basket', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['ordered_items'][0]['product_info']['price'], 1200)
+
+    def test_checkout_refreshes_catalog(self):
+        first, second = self.product_infos
+        refresh_catalog(ProductInfo.objects.all())
+        etag = self.client.get('/api/v1/products')['ETag']
+        self.client.post('/api/v1/basket', {'items': [{'product_info': first.id, 'quantity': 3}]}, format='json')
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        response = self.client.post('/api/v1/order', {'id': str(basket.id), 'contact': str(self.contact.id)})
+        self.assertEqual(response.status_code, 200)
+
+        refresh_stock(**OutboxEvent.objects.get(task='backend.handlers.refresh_stock').kwargs)
+        response = self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['id']: item['quantity'] for item in response.json()['results']},
+                         {first.id: 7, second.id: 10})
+
+    def test_checkout_missing_basket(self):
+        response = self.client.post('/api/v1/order', {'id': '0', 'contact': str(self.contact.id)})
+        self.assertEqual((response.status_code, response.json()['Errors']), (404, 'Корзина не найдена'))
+
+    def test_products_etag(self):
+        refresh_catalog(ProductInfo.objects.all())
+        etag = self.client.get('/api/v1/products')['ETag']
+        self.assertEqual(self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        invalidate_shop(self.product_infos[0].shop_id)
+        self.assertEqual(self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class UJSONRendererTests(SimpleTestCase):
+    """
+    ujson-рендерер отдает те же байты, что и стандартный JSONRenderer
+    """
+
+    def test_output_matches_json_renderer(self):
+        data = {'name': 'Смартфон Apple iPhone XS Max 512GB (золотистый)', 'url': 'https://example.com/a/b',
+                'price': Decimal('110.50'), 'dt': datetime(2024, 1, 2, 3, 4, 5, 600000, tzinfo=dt_timezone.utc),
+                'separator': 'a\u2028b', 'empty': None, 'flags': [True, False], 'ratio': 0.1,
+                'lazy': gettext_lazy('Требуется'), 'nested': [{'id': 1, 'value': 'черный'}]}
+        self.assertEqual(UJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(UJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_parser(self):
+        self.assertEqual(UJSONParser().parse(BytesIO('{"items": [{"id": 1, "name": "черный"}]}'.encode())),
+                         {'items': [{'id': 1, 'name': 'черный'}]})
+        with self.assertRaises(ParseError):
+            UJSONParser().parse(BytesIO(b'{"items": '))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, INVOICE_ADMIN_EMAILS=['admin@example.com'])
+class InvoiceTests(TestCase):
+    """
+    Накладные по заказу: магазину только его позиции, администратору весь заказ, сводка копится
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        contact = Contact.objects.create(user=buyer, zip=101000, country='Россия', city='Москва',
+                                         street='Тверская', house='1', phone='+70000000000')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        cls.order = Order.objects.create(user=buyer, state='new', contact=contact)
+        for i, (name, digest) in enumerate((('Связной', False), ('Евросеть', True))):
+            partner = User.objects.create_user(f'shop{i}@example.com', 'password', type='shop', is_active=True)
+            shop = Shop.objects.create(name=name, user=partner, invoice_digest=digest)
+            product_info = ProductInfo.objects.create(
+                product=Product.objects.create(name=f'Смартфон {name}', category=category), shop=shop,
+                external_id=i, model='apple/iphone', quantity=10, price=1000 * (i + 1), price_rrc=1000)
+            OrderItem.objects.create(order=cls.order, product_info=product_info, shop=shop, quantity=2,
+                                     price=product_info.price)
+
+    @patch('backend.handlers.push_digest')
+    @patch('backend.handlers.queue_email')
+    def test_invoices_per_shop(self, queue_email, push_digest):
+        send_invoices(self.order.id)
+        emails = {tuple(call.args[2]): call.args[1] for call in queue_email.call_args_list}
+        self.assertEqual(set(emails), {('shop0@example.com',), ('admin@example.com',)})
+        self.assertIn('Смартфон Связной', emails['shop0@example.com',])
+        self.assertNotIn('Смартфон Евросеть', emails['shop0@example.com',])
+        self.assertIn('Итого по магазину: 2000', emails['shop0@example.com',])
+        self.assertIn('Итого по магазину: 4000', emails['admin@example.com',])
+        self.assertIn('Москва, Тверская, д. 1', emails['admin@example.com',])
+        push_digest.assert_called_once_with(Shop.objects.get(name='Евросеть').id, self.order.id)
+
+    @patch('backend.handlers.pop_digest')
+    @patch('backend.handlers.queue_email')
+    def test_digest(self, queue_email, pop_digest):
+        pop_digest.return_value = [self.order.id]
+        self.assertEqual(send_invoice_digests(), {'digests': 1})
+        subject, body, recipients = queue_email.call_args.args
+        self.assertEqual(recipients, ['shop1@example.com'])
+        self.assertIn('заказов 1 на сумму 4000', body)
+        self.assertNotIn('Смартфон Связной', body)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class OutboxTests(TestCase):
+    """
+    События пишутся в одной транзакции с данными и уходят в брокер через relay_outbox
+    """
+
+    def register(self, email):
+        return APIClient().post('/api/v1/user/register', {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'email': email, 'password': 'Qwerty!2345',
+            'company': 'ООО', 'position': 'Закупщик'})
+
+    def test_registration_writes_event(self):
+        self.assertEqual(self.register('buyer@example.com').status_code, 201)
+        self.assertEqual(self.register('buyer@example.com').status_code, 403)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.task, 'backend.handlers.send_email')
+        self.assertEqual(event.kwargs['email'], 'buyer@example.com')
+        self.assertIn(ConfirmEmailToken.objects.get().key, event.kwargs['message'])
+
+    @patch('backend.outbox.celery_app')
+    def test_relay_sends_in_order_and_deletes(self, celery_app):
+        events = [enqueue('new_order', user_id=i) for i in range(3)]
+        self.assertEqual(relay_outbox(batch_size=2), 2)
+        self.assertEqual(relay_outbox(batch_size=2), 1)
+        self.assertEqual([call.kwargs['kwargs'] for call in celery_app.send_task.call_args_list],
+                         [{'user_id': i} for i in range(3)])
+        self.assertEqual([call.kwargs['task_id'] for call in celery_app.send_task.call_args_list],
+                         [f'outbox-{event.id}' for event in events])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @patch('backend.outbox.celery_app')
+    def test_broker_failure_keeps_unsent_events(self, celery_app):
+        events = [enqueue('new_order', user_id=i) for i in range(3)]
+        celery_app.send_task.side_effect = [None, OperationalError('connection refused')]
+        self.assertEqual(relay_outbox(), 1)
+        self.assertEqual(list(OutboxEvent.objects.values_list('id', 'attempts')),
+                         [(events[1].id, 1), (events[2].id, 0)])
+
+        celery_app.send_task.side_effect = None
+        self.assertEqual(relay_outbox(), 2)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class RefusingBackend(locmem.EmailBackend):
+    """
+    Почтовый бэкенд, который отказывает одному получателю и считает открытия соединения
+    """
+    opened = 0
+
+    def open(self):
+        RefusingBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if 'refused@example.com' in message.to:
+                raise smtplib.SMTPRecipientsRefused({'refused@example.com': (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MAIL_MAX_RETRIES=2, MAIL_RETRY_BACKOFF=10, MAIL_BATCH_SIZE=100)
+class MailDispatchTests(SimpleTestCase):
+    """
+    Письма уходят пачкой через одно соединение, отказы повторяются по получателю с нарастающей задержкой
+    """
+
+    def test_send_batch_reuses_connection(self):
+        RefusingBackend.opened = 0
+        messages = build_messages('Заказ', 'Заказ сформирован',
+                                  [f'buyer{i}@example.com' for i in range(5)] + ['refused@example.com'])
+        with self.assertLogs('backend.mail', 'WARNING'):
+            failed = send_batch(messages, RefusingBackend())
+        self.assertEqual([message['to'] for message in failed], ['refused@example.com'])
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(RefusingBackend.opened, 1)
+
+    @patch('backend.handlers.ack_messages')
+    @patch('backend.handlers.requeue_email')
+    @patch('backend.handlers.pop_messages')
+    def test_dispatch_retries_with_backoff(self, pop_messages, requeue_email, ack_messages):
+        message = build_messages('Заказ', 'Заказ сформирован', ['refused@example.com'])[0]
+        with self.settings(EMAIL_BACKEND='backend.tests.RefusingBackend'), self.assertLogs('backend', 'WARNING'):
+            for _ in range(3):
+                pop_messages.side_effect = [[(b'entry', message)], []]
+                dispatch_mail()
+                message = requeue_email.apply_async.call_args.args[0][0]
+        self.assertEqual([call.kwargs['countdown'] for call in requeue_email.apply_async.call_args_list], [10, 20])
+        self.assertEqual(ack_messages.call_args_list, [call([b'entry'])] * 3)
+
+    @patch('backend.handlers.ack_messages')
+    @patch('backend.handlers.pop_messages')
+    def test_dispatch_acks_after_send(self, pop_messages, ack_messages):
+        batch = [(f'entry{i}'.encode(), message) for i, message in enumerate(
+            build_messages('Заказ', 'Заказ сформирован', ['buyer0@example.com', 'buyer1@example.com']))]
+        pop_messages.side_effect = [batch, []]
+        # пока письма не ушли, они остаются в списке обрабатываемых
+        ack_messages.side_effect = lambda entries: self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(dispatch_mail(), {'sent': 2})
+        ack_messages.assert_called_once_with([b'entry0', b'entry1'])
+
+        ack_messages.reset_mock()
+        pop_messages.side_effect = [batch, []]
+        with patch('backend.handlers.send_batch', side_effect=ConnectionError), self.assertRaises(ConnectionError):
+            dispatch_mail()
+        ack_messages.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CachedListTests(TestCase):
+    """
+    Списки категорий и магазинов отдаются из кэша и с ETag, сбрасываются при изменениях
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.shop = Shop.objects.create(name='Связной')
+        self.category = Category.objects.create(id=224, name='Смартфоны')
+
+    def test_categories_etag_and_invalidation(self):
+        response = self.client.get('/api/v1/categories')
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/categories', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/categories').json()['results'][0]['name'], 'Смартфоны')
+
+        self.category.name = 'Телефоны'
+        self.category.save()
+        response = self.client.get('/api/v1/categories', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['name'], 'Телефоны')
+
+    def test_shops_follow_partner_state(self):
+        self.assertEqual(self.client.get('/api/v1/shops').json()['count'], 1)
+        # как в PartnerState: статус меняется через update, без сигналов модели
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        invalidate_shop(self.shop.id)
+        self.assertEqual(self.client.get('/api/v1/shops').json()['count'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TokenCacheTests(TestCase):
+    """
+    Токен читается из базы один раз и сбрасывается при выходе и изменении пользователя
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.buyer).key)
+
+    def get_basket(self, etag):
+        return self.client.get('/api/v1/basket', HTTP_IF_NONE_MATCH=etag)
+
+    def test_cached_until_user_changes(self):
+        etag = self.client.get('/api/v1/basket')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_basket(etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.set_password('new-password')
+            self.buyer.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_basket(etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.is_active = False
+            self.buyer.save()
+        response = self.get_basket(etag)
+        # токен отклонен аутентификацией, а не представлением
+        self.assertEqual((response.status_code, list(response.json())), (403, ['detail']))
+
+    def test_logout(self):
+        self.client.get('/api/v1/basket')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/v1/user/logout').json(), {'Status': True})
+        response = self.client.get('/api/v1/basket')
+        self.assertEqual((response.status_code, list(response.json())), (403, ['detail']))
+        self.assertFalse(Token.objects.exists())
+
+    def test_basic_authentication_disabled(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Basic ' + b64encode(b'buyer@example.com:password').decode())
+        self.assertEqual(client.get('/api/v1/basket').json(), {'Status': False, 'Error': 'Log in required'})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AsyncViewTests(TestCase):
+    """
+    Async-представления под ASGI отвечают так же, как синхронные
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        cls.token = Token.objects.create(user=cls.buyer).key
+        shop = Shop.objects.create(name='Связной')
+        Shop.objects.create(name='Евросеть', state=False)
+        category = Category.objects.create(id=224, name='Смартфоны')
+        color = Parameter.objects.create(name='Цвет')
+        product_infos = ProductInfo.objects.bulk_create([
+            ProductInfo(product=Product.objects.create(name=f'Смартфон {i}', category=category), shop=shop,
+                        external_id=i, model='apple/iphone', quantity=10, price=1000 + i, price_rrc=1100)
+            for i in range(5)
+        ])
+        ProductParameter.objects.bulk_create([ProductParameter(product_info=product_info, parameter=color,
+                                                               value='черный') for product_info in product_infos])
+        refresh_catalog(ProductInfo.objects.all())
+        contact = Contact.objects.create(user=cls.buyer, zip=101000, country='Россия', city='Москва',
+                                         street='Тверская', phone='+70000000000')
+        for state in ('basket', 'new', 'confirmed'):
+            order = Order.objects.create(user=cls.buyer, state=state, contact=contact)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product_info=product_info, shop=shop, quantity=1,
+                                                     price=product_info.price) for product_info in product_infos])
+            order.update_total()
+
+    def setUp(self):
+        cache.clear()
+        self.sync_client = APIClient()
+        self.sync_client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+
+    def call_async(self, method, url, token=None, headers=None, **kwargs):
+        headers = dict(headers or {}, **({'AUTHORIZATION': f'Token {token}'} if token else {}))
+
+        async def call():
+            return await getattr(self.async_client, method)(url, headers=headers, **kwargs)
+
+        with override_settings(ROOT_URLCONF='orders.asgi_urls'):
+            return async_to_sync(call)()
+
+    def get_async(self, url, token=None, **headers):
+        return self.call_async('get', url, token, headers)
+
+    def test_same_responses(self):
+        for url in ('/api/v1/categories', '/api/v1/shops', '/api/v1/products?page_size=2',
+                    '/api/v1/products?price_min=1002', '/api/v1/basket', '/api/v1/order?page_size=1',
+                    '/api/v1/order?state=new'):
+            with self.subTest(url=url):
+                cache.clear()
+                response = self.get_async(url, self.token)
+                self.assertEqual(response.status_code, 200)
+                cache.clear()
+                expected = self.sync_client.get(url)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['ETag'], expected['ETag'])
+                # DRF добавляет Allow, async-представления его не выставляют
+                self.assertFalse(response.has_header('Allow'))
+
+    def test_cursor_pages(self):
+        response = self.get_async('/api/v1/products?page_size=2').json()
+        ids = [item['id'] for item in response['results']]
+        while response['next']:
+            response = self.get_async(response['next']).json()
+            ids += [item['id'] for item in response['results']]
+        self.assertEqual(ids, sorted(ProductInfo.objects.values_list('id', flat=True)))
+
+    def test_conditional_and_errors(self):
+        etag = self.get_async('/api/v1/basket', self.token)['ETag']
+        # токен уже в кэше, 304 отдается без запросов к базе
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_async('/api/v1/basket', self.token, IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get_async('/api/v1/basket').status_code, 403)
+        # как у синхронных представлений: первая схема, сессия, не выставляет WWW-Authenticate
+        self.assertEqual(self.get_async('/api/v1/basket', 'wrong').status_code, 403)
+        self.assertEqual(APIClient().get('/api/v1/basket', HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+        self.assertEqual(self.get_async('/api/v1/shops?page=2').status_code, 404)
+        self.assertEqual(self.get_async('/api/v1/products?price_min=x').json(), {'price_min': ['Введите число.']})
+
+    def test_session_authentication(self):
+        self.async_client.force_login(self.buyer)
+        response = self.get_async('/api/v1/basket')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.sync_client.get('/api/v1/basket').content)
+
+    def test_writes_go_to_sync_view(self):
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        response = self.call_async('delete', '/api/v1/basket', self.token,
+                                   data={'items': str(basket.ordered_items.first().id)},
+                                   content_type='application/json')
+        self.assertEqual(response.json(), {'Status': True, 'Удалено объектов': 1})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CursorPaginationTests(TestCase):
+    """
+    AsyncCursorPagination повторяет CursorPagination.paginate_queryset из DRF: страницы и ссылки совпадают
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        # по три заказа на одну дату: курсор должен переходить через одинаковые значения ordering
+        for i in range(10):
+            order = Order.objects.create(user=buyer, state='new')
+            Order.objects.filter(id=order.id).update(dt=datetime(2024, 1, 1 + i // 3, tzinfo=dt_timezone.utc))
+
+    def paginate(self, paginator, url, use_async=False):
+        request = Request(APIRequestFactory().get(url))
+        queryset = Order.objects.all()
+        if use_async:
+            page = async_to_sync(paginator.apaginate_queryset)(queryset, request)
+        else:
+            page = paginator.paginate_queryset(queryset, request)
+        return [order.id for order in page], paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_matches_drf(self):
+        upstream = type('UpstreamPagination', (CursorPagination,), {
+            name: getattr(OrderCursorPagination, name)
+            for name in ('ordering', 'page_size', 'page_size_query_param', 'max_page_size')})
+        url, last_url, pages = 'http://testserver/api/v1/order?page_size=2', None, []
+        # вперед по next до последней страницы, затем с нее назад по previous
+        for direction in (1, 2):
+            while url:
+                with self.subTest(url=url):
+                    expected = self.paginate(upstream(), url)
+                    self.assertEqual(self.paginate(OrderCursorPagination(), url), expected)
+                    self.assertEqual(self.paginate(OrderCursorPagination(), url, use_async=True), expected)
+                pages.append(expected[0])
+                last_url, url = url, expected[direction]
+            url = last_url if direction == 1 else None
+        self.assertEqual(len(pages), 10)
+        self.assertEqual(len(set(sum(pages[:5], []))), 10)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Блокировки строк проверяются только в PostgreSQL')
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Одновременные оформления корзин с одним товаром не продают больше остатка
+    """
+
+    def test_hot_sku_is_not_oversold(self):
+        shop = Shop.objects.create(name='Связной')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        hot = ProductInfo.objects.create(product=Product.objects.create(name='Смартфон', category=category),
+                                         shop=shop, external_id=1, model='apple/iphone', quantity=5,
+                                         price=1000, price_rrc=1000)
+        baskets = []
+        for i in range(10):
+            user = User.objects.create_user(f'buyer{i}@example.com', 'password', is_active=True)
+            contact = Contact.objects.create(user=user, zip=101000, country='Россия', city='Москва',
+                                             street='Тверская', phone='+70000000000')
+            basket = Order.objects.create(user=user, state='basket')
+            OrderItem.objects.create(order=basket, product_info=hot, shop=shop, quantity=1, price=1000)
+            baskets.append((user.id, basket.id, contact.id))
+
+        def place(args):
+            try:
+                checkout(*args)
+                return True
+            except CheckoutError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(baskets)) as executor:
+            placed = list(executor.map(place, baskets))
+
+        self.assertEqual(sum(placed), 5)
+        self.assertEqual(ProductInfo.objects.get(id=hot.id).quantity, 0)
+        self.assertEqual(Order.objects.filter(state='new').count(), 5)
+
+    def test_basket_mutation_waits_for_checkout(self):
+        shop = Shop.objects.create(name='Связной')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        phone, case = [ProductInfo.objects.create(
+            product=Product.objects.create(name=name, category=category), shop=shop, external_id=external_id,
+            model='apple/iphone', quantity=5, price=1000, price_rrc=1000)
+            for external_id, name in ((1, 'Смартфон'), (2, 'Чехол'))]
+        user = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        contact = Contact.objects.create(user=user, zip=101000, country='Россия', city='Москва',
+                                         street='Тверская', phone='+70000000000')
+        basket = Order.objects.create(user=user, state='basket')
+        item = OrderItem.objects.create(order=basket, product_info=phone, shop=shop, quantity=1, price=1000)
+
+        def mutate(method, data):
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                return getattr(client, method)('/api/v1/basket', data, format='json').status_code
+            finally:
+                connection.close()
+
+        for method, data in (('post', {'items': [{'product_info': case.id, 'quantity': 1}]}),
+                             ('put', {'items': [{'id': item.id, 'quantity': 3}]}),
+                             ('delete', {'items': str(item.id)})):
+            with self.subTest(method), ThreadPoolExecutor(max_workers=1) as executor:
+                Order.objects.filter(id=basket.id).update(state='basket')
+                futures = []
+
+                # изменение корзины приходит, пока оформление держит блокировку
+                def racing_enqueue(*args, **kwargs):
+                    futures.append(executor.submit(mutate, method, data))
+                    self.assertFalse(wait(futures, timeout=0.5).done)
+                    return enqueue(*args, **kwargs)
+
+                with patch('backend.checkout.enqueue', side_effect=racing_enqueue):
+                    checkout(user.id, basket.id, contact.id)
+                self.assertLess(futures[0].result(), 300)
+
+                self.assertEqual(list(OrderItem.objects.filter(order_id=basket.id).values_list(
+                    'product_info_id', 'quantity')), [(phone.id, 1)])
+                Order.objects.filter(user=user, state='basket').exclude(id=basket.id).delete()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ImportJobTests(TestCase):
+    """
+    Импорт прайса отслеживается в ImportJob, сбои постановки и выполнения задачи не оставляют его активным
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create_user('partner@example.com', 'password', type='shop', is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.partner)
+
+    @patch('backend.views.get_import')
+    def test_one_active_import_and_status(self, task):
+        task.delay.return_value.id = 'import-1'
+        job_id = self.client.post('/api/v1/partner/update', {'url': PRICE_URL}).json()['Job']
+        task.delay.assert_called_once_with(PRICE_URL, self.partner.id, job_id=job_id)
+
+        response = self.client.post('/api/v1/partner/update', {'url': PRICE_URL})
+        self.assertEqual((response.status_code, response.json()['Job']), (409, job_id))
+
+        ImportJob.objects.filter(id=job_id).update(state='running', chunks=2, chunks_done=1, rows=10)
+        response = self.client.get(f'/api/v1/partner/update/{job_id}').json()
+        self.assertEqual({key: response[key] for key in ('state', 'chunks', 'chunks_done', 'rows')},
+                         {'state': 'running', 'chunks': 2, 'chunks_done': 1, 'rows': 10})
+        self.assertEqual(ImportJob.objects.get().task_id, 'import-1')
+
+        # зависший импорт не блокирует новый
+        ImportJob.objects.filter(id=job_id).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.client.post('/api/v1/partner/update', {'url': PRICE_URL}).status_code, 200)
+        self.assertEqual(ImportJob.objects.get(id=job_id).state, 'failed')
+
+        other = User.objects.create_user('other@example.com', 'password', type='shop', is_active=True)
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.get(f'/api/v1/partner/update/{job_id}').status_code, 404)
+
+    @patch('backend.views.get_import')
+    def test_broker_failure_fails_job(self, task):
+        task.delay.side_effect = OperationalError('connection refused')
+        response = self.client.post('/api/v1/partner/update', {'url': PRICE_URL})
+        self.assertEqual(response.status_code, 503)
+        job = ImportJob.objects.get()
+        self.assertEqual((job.state, job.error), ('failed', 'connection refused'))
+
+        task.delay.side_effect = None
+        task.delay.return_value.id = 'import-1'
+        self.assertEqual(self.client.post('/api/v1/partner/update', {'url': PRICE_URL}).status_code, 200)
+
+    @patch('backend.handlers.download')
+    def test_unexpected_error_fails_job(self, download):
+        download.side_effect = RuntimeError('No space left on device')
+        job = ImportJob.objects.create(user=self.partner, url=PRICE_URL)
+        with self.assertRaises(RuntimeError):
+            get_import(PRICE_URL, self.partner.id, job_id=job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), ('failed', 'No space left on device'))
+
+
+def good(external_id, name='Смартфон', category=224, price=1000, quantity=10, **parameters):
+    """
+    Позиция прайса в формате shop.yaml
+    """
+    return {'id': external_id, 'category': category, 'model': 'apple/iphone', 'name': name, 'price': price,
+            'price_rrc': price, 'quantity': quantity, 'parameters': parameters}
+
+
+def price_list(goods, categories=None, shop='Связной'):
+    return yaml.safe_dump({'shop': shop, 'categories': categories or [{'id': 224, 'name': 'Смартфоны'}],
+                           'goods': goods}, allow_unicode=True, sort_keys=False).encode()
+
+
+class PriceListTests(SimpleTestCase):
+    """
+    Потоковое чтение прайсов yaml, json и csv
+    """
+
+    def read(self, data, price_format='yaml'):
+        return list(read_price_list(BytesIO(data), price_format))
+
+    def test_yaml(self):
+        records = self.read(price_list([good(1, Цвет='черный'), good(2, price=500)]))
+        self.assertEqual(records, [('shop', 'Связной'), ('category', {'id': 224, 'name': 'Смартфоны'}),
+                                   ('good', good(1, Цвет='черный')), ('good', good(2, price=500))])
+        self.assertEqual(self.read('{"shop": "Связной", "goods": [{"id": 1}]}'.encode()),
+                         [('shop', 'Связной'), ('good', {'id': 1})])
+
+    def test_goods_before_shop(self):
+        data = yaml.safe_dump({'goods': [good(1)], 'categories': [{'id': 224, 'name': 'Смартфоны'}],
+                               'shop': 'Связной'}, allow_unicode=True, sort_keys=False).encode()
+        self.assertEqual(self.read(data), [('shop', 'Связной'), ('good', good(1)),
+                                           ('category', {'id': 224, 'name': 'Смартфоны'})])
+        with self.settings(IMPORT_MAX_PENDING=1), self.assertRaises(ValueError):
+            self.read(data)
+        with self.assertRaises(ValueError):
+            self.read(yaml.safe_dump({'goods': [good(1)]}).encode())
+
+    def test_anchors(self):
+        data = 'shop: Связной\ngoods:\n  - &first {id: 1, parameters: &color {Цвет: черный}}\n' \
+               '  - {id: 2, parameters: *color}\n  - *first\n'.encode()
+        self.assertEqual([value for _, value in self.read(data)[1:]],
+                         [{'id': 1, 'parameters': {'Цвет': 'черный'}}, {'id': 2, 'parameters': {'Цвет': 'черный'}},
+                          {'id': 1, 'parameters': {'Цвет': 'черный'}}])
+        with self.settings(IMPORT_MAX_ANCHORS=1), self.assertRaises(ValueError):
+            self.read(data)
+
+    def test_csv(self):
+        data = ('shop,category,category_name,id,model,name,price,price_rrc,quantity,Цвет\n'
+                'Связной,224,Смартфоны,1,apple/iphone,Смартфон,1000,1000,10,черный\n'
+                'Связной,224,Смартфоны,2,apple/iphone,Смартфон,1000,1000,10,\n').encode('utf-8-sig')
+        self.assertEqual(self.read(data, 'csv'), [
+            ('shop', 'Связной'), ('category', {'id': '224', 'name': 'Смартфоны'}),
+            ('good', {key: str(value) if key != 'parameters' else value
+                      for key, value in good(1, Цвет='черный').items()}),
+            ('good', {key: str(value) if key != 'parameters' else value for key, value in good(2).items()}),
+        ])
+        with self.assertRaises(ValueError):
+            self.read('shop,id\nСвязной,1\n'.encode(), 'csv')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PriceImportTests(TestCase):
+    """
+    Импорт прайса через get_import, пачки выполняются на месте (task_always_eager)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create_user('partner@example.com', 'password', type='shop', is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+    def run_import(self, data, incremental=True, price_hash=None, job_id=None):
+        price_hash = price_hash or hashlib.sha256(data).hexdigest()
+        with patch('backend.handlers.download', return_value=(BytesIO(data), {'ETag': '"v1"'}, price_hash)):
+            return get_import(PRICE_URL, self.partner.id, incremental=incremental, job_id=job_id)
+
+    def test_full_import(self):
+        result = self.run_import(price_list([good(1, 'Смартфон A', Цвет='черный', Память=64),
+                                             good(2, 'Смартфон A', price=900, Цвет='белый'),
+                                             good(3, 'Смартфон B')]), incremental=False)
+        self.assertEqual(result['Stats']['changes']['created'], 3)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(sorted(Parameter.objects.values_list('name', flat=True)), ['Память', 'Цвет'])
+        self.assertEqual(sorted(ProductParameter.objects.values_list('product_info__external_id', 'parameter__name',
+                                                                     'value')),
+                         [(1, 'Память', '64'), (1, 'Цвет', 'черный'), (2, 'Цвет', 'белый')])
+        self.assertEqual(CatalogItem.objects.count(), 3)
+
+        result = self.run_import(price_list([good(2, 'Смартфон A', price=800)]), incremental=False)
+        self.assertEqual((result['Stats']['changes']['created'], result['Stats']['changes']['deleted']), (1, 3))
+        self.assertEqual(list(ProductInfo.objects.values_list('external_id', 'price')), [(2, 800)])
+        self.assertEqual((Product.objects.count(), ProductParameter.objects.count()), (2, 0))
+
+    def test_incremental_diff(self):
+        self.run_import(price_list([good(1, Цвет='черный'), good(2, Цвет='черный', Память=64), good(3)]))
+        ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+
+        result = self.run_import(price_list([good(1, Цвет='черный'), good(2, price=900, Цвет='белый'), good(4)],
+                                            categories=[{'id': 224, 'name': 'Телефоны'}]))
+        self.assertEqual(result['Stats']['changes'], {'created': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1})
+        # позиции сопоставляются по внешнему ИД и сохраняют свои ИД
+        self.assertEqual({external_id: product_info_id for external_id, product_info_id in
+                          ProductInfo.objects.values_list('external_id', 'id') if external_id in (1, 2)},
+                         {1: ids[1], 2: ids[2]})
+        self.assertEqual(sorted(ProductInfo.objects.values_list('external_id', 'price')),
+                         [(1, 1000), (2, 900), (4, 1000)])
+        self.assertEqual(list(ProductParameter.objects.filter(product_info_id=ids[2]).values_list(
+            'parameter__name', 'value')), [('Цвет', 'белый')])
+        self.assertEqual(Category.objects.get(id=224).name, 'Телефоны')
+
+    def test_ordered_items_survive_reimport(self):
+        self.run_import(price_list([good(1), good(2), good(3)]))
+        buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        ordered = {external_id: ProductInfo.objects.get(external_id=external_id) for external_id in (1, 2)}
+        for state, external_id in (('new', 1), ('basket', 2)):
+            order = Order.objects.create(user=buyer, state=state)
+            OrderItem.objects.create(order=order, product_info=ordered[external_id],
+                                     shop=ordered[external_id].shop, quantity=1, price=1000)
+
+        # позиции из заказа и корзины пропали из прайса: остаются без остатка, свободная удаляется
+        result = self.run_import(price_list([good(4)]))
+        self.assertEqual(result['Stats']['changes']['deleted'], 3)
+        self.assertEqual(sorted(ProductInfo.objects.values_list('external_id', 'quantity')),
+                         [(1, 0), (2, 0), (4, 10)])
+        self.assertEqual(OrderItem.objects.count(), 2)
+        self.assertEqual(dict(CatalogItem.objects.values_list('product_info__external_id', 'data__quantity')),
+                         {1: 0, 2: 0, 4: 10})
+
+        # при полной перезаливке позиция из заказа сопоставляется с прайсом и сохраняет свой ИД
+        result = self.run_import(price_list([good(1, quantity=5), good(4)]), incremental=False)
+        self.assertEqual(sorted(ProductInfo.objects.values_list('id', 'external_id', 'quantity')),
+                         [(ordered[1].id, 1, 5), (ordered[2].id, 2, 0),
+                          (ProductInfo.objects.get(external_id=4).id, 4, 10)])
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+    def test_renamed_category_refreshes_other_shops(self):
+        other_shop = Shop.objects.create(name='Евросеть')
+        category = Category.objects.create(id=224, name='Смартфоны')
+        ProductInfo.objects.create(product=Product.objects.create(name='Смартфон', category=category),
+                                   shop=other_shop, external_id=1, model='apple/iphone', quantity=1, price=1,
+                                   price_rrc=1)
+        refresh_catalog(ProductInfo.objects.all())
+        version = get_version(f'shop:{other_shop.id}')
+
+        self.run_import(price_list([good(1)], categories=[{'id': 224, 'name': 'Телефоны'}]))
+        self.assertEqual({item.shop_id: item.data['product']['category'] for item in CatalogItem.objects.all()},
+                         {other_shop.id: 'Телефоны', Shop.objects.get(user=self.partner).id: 'Телефоны'})
+        # кэш каталога другого магазина тоже сброшен
+        self.assertGreater(get_version(f'shop:{other_shop.id}'), version)
+
+    def test_incremental_refreshes_changed_rows(self):
+        self.run_import(price_list([good(1), good(2), good(3)]))
+        with patch('backend.handlers.refresh_catalog', side_effect=refresh_catalog) as refresh:
+            self.run_import(price_list([good(1), good(2, price=900), good(4)]))
+        self.assertEqual(sorted(refresh.call_args.args[0].values_list('external_id', flat=True)), [2, 4])
+        self.assertEqual(sorted(CatalogItem.objects.values_list('product_info__external_id', 'price')),
+                         [(1, 1000), (2, 900), (4, 1000)])
+
+    @patch('backend.price_lists.requests.get')
+    def test_download_conditional(self, get):
+        response = get.return_value.__enter__.return_value
+        response.status_code = 304
+        self.assertEqual(download(PRICE_URL, '"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')[::2], (None, None))
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"',
+                                                           'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+
+        response.status_code = 200
+        response.iter_content.return_value = [b'shop: ', 'Связной'.encode()]
+        file, headers, price_hash = download(PRICE_URL)
+        with file:
+            self.assertEqual(file.read(), 'shop: Связной'.encode())
+        self.assertEqual(price_hash, hashlib.sha256('shop: Связной'.encode()).hexdigest())
+        self.assertEqual(get.call_args.kwargs['headers'], {})
+
+    def test_unchanged_hash_skips_only_incremental(self):
+        self.run_import(price_list([good(1, price=1000)]), price_hash='v1')
+        shop = Shop.objects.get(user=self.partner)
+        self.assertEqual((shop.url, shop.price_hash, shop.price_etag), (PRICE_URL, 'v1', '"v1"'))
+
+        result = self.run_import(price_list([good(1, price=2000)]), price_hash='v1')
+        self.assertEqual(result, {'Status': True, 'Skipped': 'Price list is not modified'})
+        self.assertEqual(ProductInfo.objects.get().price, 1000)
+
+        result = self.run_import(price_list([good(1, price=2000)]), incremental=False, price_hash='v1')
+        self.assertEqual(result['Stats']['changes']['created'], 1)
+        self.assertEqual(ProductInfo.objects.get().price, 2000)
+
+    @override_settings(IMPORT_SHARD_SIZE=2)
+    def test_chunks_dispatched_as_prepared(self):
+        self.run_import(price_list([good(i) for i in range(5)]), price_hash='v1')
+        job = ImportJob.objects.create(user=self.partner, url=PRICE_URL)
+        with patch('backend.handlers.finish_import.delay', side_effect=finish_import) as finish:
+            result = self.run_import(price_list([good(i, price=2000 if i == 1 else 1000) for i in range(1, 7)]),
+                                     price_hash='v2', job_id=job.id)
+        self.assertEqual(result, {'Status': True, 'Chunks': 3})
+        finish.assert_called_once()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.chunks, job.chunks_done), ('done', 3, 3))
+        self.assertEqual((job.rows, job.created, job.updated, job.deleted, job.unchanged), (6, 2, 1, 1, 3))
+        self.assertEqual(sorted(ProductInfo.objects.values_list('external_id', flat=True)), list(range(1, 7)))
+        self.assertEqual(Shop.objects.get().price_hash, 'v2')
+
+    @override_settings(IMPORT_SHARD_SIZE=2)
+    def test_failed_chunk_fails_job(self):
+        self.run_import(price_list([good(i) for i in range(5)]), price_hash='v1')
+        job = ImportJob.objects.create(user=self.partner, url=PRICE_URL)
+        with patch('backend.handlers.PriceImporter.write', side_effect=[None, ValueError('Нет категории'), None]):
+            self.run_import(price_list([good(i) for i in range(1, 6)]), price_hash='v2', job_id=job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error, job.chunks_done), ('failed', 'Нет категории', 2))
+        # прайс не считается загруженным, повтор того же прайса не будет пропущен
+        self.assertEqual(Shop.objects.get().price_hash, 'v1')
+        # пропавшая из прайса позиция удаляется только после записи всех пачек
+        self.assertTrue(ProductInfo.objects.filter(external_id=0).exists())
+
+    @override_settings(IMPORT_SHARD_SIZE=2)
+    def test_repeated_external_id_goes_to_one_chunk(self):
+        job = ImportJob.objects.create(user=self.partner, url=PRICE_URL)
+        with patch('backend.handlers.import_chunk.apply_async', side_effect=import_chunk.apply_async) as dispatch, \
+                patch('backend.handlers.finish_import.delay', side_effect=finish_import):
+            self.run_import(price_list([good(1), good(2), good(1, price=2000), good(3), good(2, price=3000)]),
+                            job_id=job.id)
+        self.assertEqual([[item['id'] for item in call.args[0][1]] for call in dispatch.call_args_list],
+                         [[1, 2], [3]])
+        self.assertEqual(sorted(ProductInfo.objects.values_list('external_id', 'price')),
+                         [(1, 1000), (2, 1000), (3, 1000)])
+
+    @patch('backend.handlers.download')
+    def test_not_modified_skips(self, download_price_list):
+        self.run_import(price_list([good(1)]), price_hash='v1')
+        download_price_list.return_value = (None, {'ETag': '"v1"'}, None)
+        job = ImportJob.objects.create(user=self.partner, url=PRICE_URL)
+        self.assertIn('Skipped', get_import(PRICE_URL, self.partner.id, job_id=job.id))
+        self.assertEqual(download_price_list.call_args.args, (PRICE_URL, '"v1"', ''))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'done')
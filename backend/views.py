@@ -1,26 +1,45 @@
+from datetime import timedelta
 from distutils.util import strtobool
 
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from django.core.cache import cache
 
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F
+from django.db import IntegrityError, transaction
+from django.db.models import Q, F, Sum, Case, When, Value, PositiveIntegerField, OuterRef, Subquery, Exists, \
+    Prefetch
 from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
+from django_filters.rest_framework import DjangoFilterBackend
+from kombu.exceptions import OperationalError
 from rest_framework import status
 
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from rest_framework.views import APIView
 from ujson import loads as load_json
 
-from backend.models import Shop, Category, ProductInfo, Order, OrderItem, Contact, ConfirmEmailToken
-from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer
-from backend.signals import new_order
-from .tasks import get_import, send_email
+from backend.cache import catalog_cache_key, catalog_scope, invalidate_shop, invalidate_user, idempotent, \
+    versioned_cache_key, versioned_etag, get_modified, user_etag, user_last_modified, user_catalog_etag, \
+    user_catalog_last_modified
+from backend.catalog import set_shop_state, search_catalog, catalog_facets
+from backend.checkout import checkout, CheckoutError
+from backend.filters import CatalogItemFilter, OrderFilter
+from backend.models import Shop, Category, ProductInfo, CatalogItem, Order, OrderItem, Contact, ConfirmEmailToken, \
+    ImportJob, IMPORT_ACTIVE_STATES
+from backend.outbox import enqueue
+from backend.pagination import ProductInfoCursorPagination, OrderCursorPagination
+from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, CatalogItemSerializer, \
+    PartnerOrderSerializer, ContactSerializer, ImportJobSerializer, ORDER_SUMMARY_FIELDS, serialize_orders, \
+    serialize_order_summaries
+from backend.handlers import get_import
 
 
 class RegisterAccount(APIView):
@@ -45,13 +64,14 @@ class RegisterAccount(APIView):
                 request.data.update({})
                 user_serializer = UserSerializer(data=request.data)
                 if user_serializer.is_valid():
-                    # сохраняем пользователя
-                    user = user_serializer.save()
-                    user.set_password(request.data['password'])
-                    user.save()
-                    token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user.id)
-                    send_email.delay('Подтверждение регистрации', f'Токен для подтверждения {token.key}',
-                                     user.email)
+                    # сохраняем пользователя, письмо уйдет через outbox только вместе с ним
+                    with transaction.atomic():
+                        user = user_serializer.save()
+                        user.set_password(request.data['password'])
+                        user.save()
+                        token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user.id)
+                        enqueue('backend.handlers.send_email', title='Подтверждение регистрации',
+                                message=f'Токен для подтверждения {token.key}', email=user.email)
                     return JsonResponse({'Status': True, 'Token for email confirmation': token.key},
                                         status=status.HTTP_201_CREATED)
                 else:
@@ -161,50 +181,115 @@ class LoginAccount(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryView(ListAPIView):
+class LogoutAccount(APIView):
+    """
+    Класс для выхода: токен удаляется и сразу перестает приниматься
+    """
+
+    # Выход методом POST
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        Token.objects.filter(user_id=request.user.id).delete()
+        return JsonResponse({'Status': True})
+
+
+class VersionedListMixin:
+    """
+    Кэширует страницы списка по версии области кэша и отвечает 304 на If-None-Match
+    и If-Modified-Since по этой же версии, не обращаясь к базе
+    """
+    cache_scope = None
+    cache_prefix = 'list'
+    cache_timeout_setting = 'LIST_CACHE_TIMEOUT'
+
+    def get_cache_scope(self, request):
+        return self.cache_scope
+
+    def get(self, request, *args, **kwargs):
+        scope = self.get_cache_scope(request)
+        return condition(etag_func=lambda request, *args, **kwargs: versioned_etag(request, scope),
+                         last_modified_func=lambda request, *args, **kwargs: get_modified(scope))(
+            super().get)(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        cache_key = versioned_cache_key(self.cache_prefix, self.get_cache_scope(request), request)
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, getattr(settings, self.cache_timeout_setting))
+        return Response(data)
+
+
+class CategoryView(VersionedListMixin, ListAPIView):
     """
     Класс для просмотра категорий
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_scope = 'categories'
 
 
-class ShopView(ListAPIView):
+class ShopView(VersionedListMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
     queryset = Shop.objects.filter(state=True)
     serializer_class = ShopSerializer
+    cache_scope = 'shops'
 
 
-class ProductInfoView(APIView):
+class ProductInfoView(VersionedListMixin, ListAPIView):
     """
     Класс для поиска товаров
     """
 
     throttle_classes = (AnonRateThrottle,)
+    # выдача из витрины каталога одним запросом без join
+    queryset = CatalogItem.objects.filter(shop_state=True).only('product_info_id', 'data')
+    serializer_class = CatalogItemSerializer
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = CatalogItemFilter
+    pagination_class = ProductInfoCursorPagination
+    # ответ кэшируется до импорта или смены статуса магазина
+    cache_prefix = 'products'
+    cache_timeout_setting = 'CATALOG_CACHE_TIMEOUT'
 
-    def get(self, request, *args, **kwargs):
+    def get_cache_scope(self, request):
+        return catalog_scope(request)
 
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
 
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
+class ProductSearchView(APIView):
+    """
+    Класс для полнотекстового поиска товаров с фасетами по магазинам и параметрам
+    """
 
-        if category_id:
-            query = query & Q(product__category_id=category_id)
+    throttle_classes = (AnonRateThrottle,)
 
-        # фильтруем и отбрасываем дуликаты
-        queryset = ProductInfo.objects.filter(
-            query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        cache_key = catalog_cache_key(request)
+        data = cache.get(cache_key)
+        if data is None:
+            filterset = CatalogItemFilter(request.query_params, queryset=CatalogItem.objects.filter(shop_state=True),
+                                          request=request)
+            if not filterset.is_valid():
+                return JsonResponse({'Status': False, 'Errors': filterset.errors},
+                                    status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(serializer.data)
+            matched, ordered = search_catalog(filterset.qs, text)
+            paginator = LimitOffsetPagination()
+            page = paginator.paginate_queryset(ordered.only('product_info_id', 'data'), request, view=self)
+            data = paginator.get_paginated_response(CatalogItemSerializer(page, many=True).data).data
+            data['facets'] = catalog_facets(matched)
+            cache.set(cache_key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data)
 
 
 class BasketView(APIView):
@@ -215,20 +300,16 @@ class BasketView(APIView):
     throttle_classes = (UserRateThrottle,)
 
     # получить корзину
+    @method_decorator(condition(etag_func=user_catalog_etag, last_modified_func=user_catalog_last_modified))
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'},
                                 status=status.HTTP_403_FORBIDDEN)
-        basket = Order.objects.filter(
-            user_id=request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        basket = Order.objects.filter(user_id=request.user.id, state='basket')
+        return Response(serialize_orders(basket))
 
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
-
-    # редактировать корзину
+    # редактировать корзину: добавляет позиции или заменяет количество уже добавленных
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'},
@@ -237,29 +318,54 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
+                items_dict = load_json(items_sting) if isinstance(items_sting, str) else items_sting
             except ValueError:
-                JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_created = 0
-                for order_item in items_dict:
-                    order_item.update({'order': basket.id})
-                    serializer = OrderItemSerializer(data=order_item)
-                    if serializer.is_valid():
-                        try:
-                            serializer.save()
-                        except IntegrityError as error:
-                            return JsonResponse({'Status': False, 'Errors': str(error)})
-                        else:
-                            objects_created += 1
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(items_dict, list):
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                    status=status.HTTP_400_BAD_REQUEST)
 
+            # все товары проверяются одним запросом
+            product_info_ids = {item['product_info'] for item in items_dict
+                                if isinstance(item, dict) and type(item.get('product_info')) == int}
+            product_infos = {product_info_id: (shop_id, price) for product_info_id, shop_id, price in
+                             ProductInfo.objects.filter(id__in=product_info_ids, shop__state=True).values_list(
+                                 'id', 'shop_id', 'price')}
+
+            # корзина блокируется так же, как при оформлении: запись не попадет в уже оформленный заказ
+            with transaction.atomic():
+                basket, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id,
+                                                                            state='basket')
+                results, order_items = [], {}
+                for order_item in items_dict:
+                    product_info_id = order_item.get('product_info') if isinstance(order_item, dict) else None
+                    quantity = order_item.get('quantity') if isinstance(order_item, dict) else None
+                    if type(product_info_id) != int:
+                        results.append({'product_info': product_info_id, 'Status': False,
+                                        'Errors': 'Неверно указан товар'})
+                    elif product_info_id not in product_infos:
+                        results.append({'product_info': product_info_id, 'Status': False,
+                                        'Errors': 'Товар не найден или магазин не принимает заказы'})
+                    elif type(quantity) != int or quantity < 1:
+                        results.append({'product_info': product_info_id, 'Status': False,
+                                        'Errors': 'Неверно указано количество'})
                     else:
-
-                        JsonResponse({'Status': False, 'Errors': serializer.errors})
-
-                return JsonResponse({'Status': True, 'Создано объектов': objects_created},
-                                    status.HTTP_201_CREATED)
+                        shop_id, price = product_infos[product_info_id]
+                        order_items[product_info_id] = OrderItem(order_id=basket.id, product_info_id=product_info_id,
+                                                                 shop_id=shop_id, quantity=quantity, price=price)
+                        results.append({'product_info': product_info_id, 'Status': True})
+
+                # одна вставка с обновлением количества и цены по ограничению unique_order_item
+                OrderItem.objects.bulk_create(order_items.values(), update_conflicts=True,
+                                              unique_fields=['order', 'product_info'],
+                                              update_fields=['quantity', 'price'])
+                if order_items:
+                    basket.update_total()
+            if order_items:
+                invalidate_user(request.user.id)
+            return JsonResponse({'Status': True, 'Создано объектов': len(order_items), 'Позиции': results},
+                                status=status.HTTP_201_CREATED)
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
                             status.HTTP_400_BAD_REQUEST)
 
@@ -270,23 +376,22 @@ class BasketView(APIView):
 
         items_sting = request.data.get('items')
         if items_sting:
-            items_list = items_sting.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=order_item_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
+            items_list = [order_item_id for order_item_id in items_sting.split(',') if order_item_id.isdigit()]
+            if items_list:
+                with transaction.atomic():
+                    basket, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id,
+                                                                                state='basket')
+                    deleted_count = OrderItem.objects.filter(order_id=basket.id, id__in=items_list).delete()[0]
+                    if deleted_count:
+                        basket.update_total()
+                if deleted_count:
+                    invalidate_user(request.user.id)
                 return JsonResponse({'Status': True, 'Удалено объектов': deleted_count},
                                     status=status.HTTP_200_OK)
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
                             status.HTTP_400_BAD_REQUEST)
 
-    # добавить позиции в корзину
+    # изменить количество позиций в корзине
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -294,19 +399,53 @@ class BasketView(APIView):
         items_sting = request.data.get('items')
         if items_sting:
             try:
-                items_dict = load_json(items_sting)
+                items_dict = load_json(items_sting) if isinstance(items_sting, str) else items_sting
             except ValueError:
-                JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_updated = 0
-                for order_item in items_dict:
-                    if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                        objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['id']).update(
-                            quantity=order_item['quantity'])
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(items_dict, list):
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'},
+                                    status=status.HTTP_400_BAD_REQUEST)
 
-                return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated},
-                                    status=status.HTTP_200_OK)
+            order_item_ids = {order_item['id'] for order_item in items_dict
+                              if isinstance(order_item, dict) and type(order_item.get('id')) == int}
+            quantities = {
+                order_item['id']: order_item['quantity'] for order_item in items_dict
+                if isinstance(order_item, dict) and type(order_item.get('id')) == int
+                and type(order_item.get('quantity')) == int and order_item['quantity'] > 0
+            }
+            objects_updated = 0
+            with transaction.atomic():
+                basket, _ = Order.objects.select_for_update().get_or_create(user_id=request.user.id,
+                                                                            state='basket')
+                basket_item_ids = set(OrderItem.objects.filter(order_id=basket.id, id__in=order_item_ids).values_list(
+                    'id', flat=True))
+                results = []
+                for order_item in items_dict:
+                    order_item_id = order_item.get('id') if isinstance(order_item, dict) else None
+                    quantity = order_item.get('quantity') if isinstance(order_item, dict) else None
+                    if type(order_item_id) != int:
+                        results.append({'id': order_item_id, 'Status': False, 'Errors': 'Неверно указана позиция'})
+                    elif order_item_id not in basket_item_ids:
+                        results.append({'id': order_item_id, 'Status': False, 'Errors': 'Позиция не найдена в корзине'})
+                    elif type(quantity) != int or quantity < 1:
+                        results.append({'id': order_item_id, 'Status': False, 'Errors': 'Неверно указано количество'})
+                    else:
+                        results.append({'id': order_item_id, 'Status': True})
+
+                if quantities:
+                    # одно UPDATE ... CASE на все позиции
+                    objects_updated = OrderItem.objects.filter(order_id=basket.id, id__in=quantities).update(
+                        quantity=Case(*[When(id=order_item_id, then=Value(quantity))
+                                        for order_item_id, quantity in quantities.items()],
+                                      default=F('quantity'), output_field=PositiveIntegerField()))
+                    if objects_updated:
+                        basket.update_total()
+            if objects_updated:
+                invalidate_user(request.user.id)
+
+            return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated, 'Позиции': results},
+                                status=status.HTTP_200_OK)
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
                             status.HTTP_400_BAD_REQUEST)
 
@@ -329,18 +468,59 @@ class PartnerUpdate(APIView):
 
         url = request.data.get('url')
         if url:
+            # зависшие импорты не должны навсегда блокировать новые
+            ImportJob.objects.filter(
+                user_id=request.user.id, state__in=IMPORT_ACTIVE_STATES,
+                created_at__lt=timezone.now() - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT)).update(
+                state='failed', error='Timeout', finished_at=timezone.now())
             try:
-                task = get_import.delay(url, request.user.id)
-            except IntegrityError as e:
-                return JsonResponse({'Status': False,
-                                     'Errors': f'Integrity Error: {e}'})
+                with transaction.atomic():
+                    job = ImportJob.objects.create(user_id=request.user.id, url=url)
+            except IntegrityError:
+                job = ImportJob.objects.filter(user_id=request.user.id, state__in=IMPORT_ACTIVE_STATES).first()
+                return JsonResponse({'Status': False, 'Errors': 'Import is already in progress',
+                                     'Job': job.id if job else None},
+                                    status=status.HTTP_409_CONFLICT)
 
-            return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
+            try:
+                task = get_import.delay(url, request.user.id, job_id=job.id)
+            except OperationalError as e:
+                # задача не поставлена, иначе запись заблокирует следующие импорты до IMPORT_JOB_TIMEOUT
+                ImportJob.objects.filter(id=job.id).update(state='failed', error=str(e), finished_at=timezone.now())
+                return JsonResponse({'Status': False, 'Errors': 'Import queue is unavailable', 'Job': job.id},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            ImportJob.objects.filter(id=job.id).update(task_id=task.id)
+            return JsonResponse({'Status': True, 'Job': job.id}, status=status.HTTP_200_OK)
 
         return JsonResponse({'Status': False, 'Errors': 'All necessary arguments are not specified'},
                             status=status.HTTP_400_BAD_REQUEST)
 
 
+class PartnerUpdateStatus(APIView):
+    """
+    Класс для просмотра хода импорта прайса
+    """
+
+    throttle_classes = (UserRateThrottle,)
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'For shops only'},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if not job:
+            return JsonResponse({'Status': False, 'Errors': 'Import not found'},
+                                status=status.HTTP_404_NOT_FOUND)
+
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
+
+
 class PartnerState(APIView):
     """
     Класс для работы со статусом поставщика
@@ -375,6 +555,10 @@ class PartnerState(APIView):
         if state:
             try:
                 Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                shop_ids = list(Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
+                set_shop_state(shop_ids, strtobool(state))
+                for shop_id in shop_ids:
+                    invalidate_shop(shop_id)
                 return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -399,14 +583,21 @@ class PartnerOrders(APIView):
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'},
                                 status=status.HTTP_403_FORBIDDEN)
 
-        order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
+        if shop_id is None:
+            return JsonResponse({'Status': False, 'Errors': 'Магазин не найден'},
+                                status=status.HTTP_404_NOT_FOUND)
 
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        # заказы выбираются через EXISTS по позициям магазина, без join и distinct;
+        # в ответ попадают только позиции этого магазина и их сумма
+        shop_items = OrderItem.objects.filter(order_id=OuterRef('pk'), shop_id=shop_id)
+        order = Order.objects.filter(Exists(shop_items)).exclude(state='basket').select_related(
+            'contact').annotate(
+            shop_total=Subquery(shop_items.values('order_id').annotate(
+                total=Sum(F('quantity') * F('price'))).values('total'))).prefetch_related(
+            Prefetch('ordered_items', to_attr='shop_items',
+                     queryset=OrderItem.objects.filter(shop_id=shop_id).select_related('product_info__product')))
+        return order_history(request, order, self, lambda page: PartnerOrderSerializer(page, many=True).data)
 
 
 class ContactView(APIView):
@@ -493,6 +684,21 @@ class ContactView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
+def order_history(request, queryset, view, serialize):
+    """
+    Страница истории заказов в кратком виде с фильтрами по статусу и периоду,
+    serialize превращает страницу в представление
+    """
+    filterset = OrderFilter(request.query_params, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        return JsonResponse({'Status': False, 'Errors': filterset.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    paginator = OrderCursorPagination()
+    page = paginator.paginate_queryset(filterset.qs, request, view=view)
+    return paginator.get_paginated_response(serialize(page))
+
+
 class OrderView(APIView):
     """
     Класс для получения и размешения заказов пользователями
@@ -501,45 +707,57 @@ class OrderView(APIView):
     throttle_classes = (UserRateThrottle,)
 
     # получить мои заказы
+    @method_decorator(condition(etag_func=user_etag, last_modified_func=user_last_modified))
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'},
                                 status=status.HTTP_403_FORBIDDEN)
-        order = Order.objects.filter(
-            user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        order = Order.objects.filter(user_id=request.user.id).exclude(state='basket').values(*ORDER_SUMMARY_FIELDS)
+        return order_history(request, order, self, serialize_order_summaries)
 
     # разместить заказ из корзины
+    @idempotent
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'},
                                 status=status.HTTP_403_FORBIDDEN)
 
         if {'id', 'contact'}.issubset(request.data):
-            if request.data['id'].isdigit():
+            if str(request.data['id']).isdigit() and str(request.data['contact']).isdigit():
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        state='new')
-                except IntegrityError as error:
-                    print(error)
-                    return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'},
-                                        status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    if is_updated:
-                        new_order.send(sender=self.__class__, user_id=request.user.id)
-                        return JsonResponse({'Status': True},
-                                            status=status.HTTP_200_OK)
+                    # уведомления пишутся в outbox в транзакции оформления и не ждут брокер
+                    with transaction.atomic():
+                        order = checkout(request.user.id, int(request.data['id']), int(request.data['contact']))
+                        enqueue('new_order', user_id=request.user.id)
+                        enqueue('backend.handlers.send_invoices', order_id=order.id)
+                except CheckoutError as error:
+                    return JsonResponse({'Status': False, 'Errors': error.errors}, status=error.status_code)
+                return JsonResponse({'Status': True},
+                                    status=status.HTTP_200_OK)
 
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'},
                             status=status.HTTP_400_BAD_REQUEST)
 
 
+class OrderDetailView(APIView):
+    """
+    Класс для получения заказа пользователя со всеми позициями
+    """
+
+    throttle_classes = (UserRateThrottle,)
+
+    @method_decorator(condition(etag_func=user_catalog_etag, last_modified_func=user_catalog_last_modified))
+    def get(self, request, order_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        order = serialize_orders(Order.objects.filter(user_id=request.user.id, id=order_id).exclude(state='basket'))
+        if not order:
+            return JsonResponse({'Status': False, 'Errors': 'Заказ не найден'},
+                                status=status.HTTP_404_NOT_FOUND)
+        return Response(order[0])
+
+
 class Home(TemplateView):
     template_name = 'home.html'
\ No newline at end of file
@@ -2,6 +2,7 @@
 ASGI config for orders project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it under uvicorn: uvicorn orders.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -9,8 +10,22 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'orders.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+
+class AsyncURLConfHandler(ASGIHandler):
+    """
+    Под ASGI запросы разрешаются по ASGI_URLCONF с async-представлениями горячих чтений
+    """
+
+    async def get_response_async(self, request):
+        request.urlconf = settings.ASGI_URLCONF
+        return await super().get_response_async(request)
+
+
+django.setup(set_prefix=False)
+application = AsyncURLConfHandler()
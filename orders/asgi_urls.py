@@ -0,0 +1,10 @@
+"""
+URL-схема для ASGI: горячие чтения API обслуживают async-представления backend.async_urls
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('api/v1/', include('backend.async_urls', namespace='backend')),
+]
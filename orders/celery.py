@@ -1,6 +1,6 @@
 import celery
 
-from orders.settings import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
+from orders.settings import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, INVOICE_DIGEST_INTERVAL, MAIL_RESTORE_INTERVAL
 
 
 celery_app = celery.Celery(
@@ -8,4 +8,28 @@ celery_app = celery.Celery(
     backend=CELERY_RESULT_BACKEND
 )
 
+# почта разбирается отдельным воркером: celery -A orders.celery worker -Q mail
+celery_app.conf.task_routes = {
+    'backend.handlers.send_email': {'queue': 'mail'},
+    'backend.handlers.dispatch_mail': {'queue': 'mail'},
+    'backend.handlers.requeue_email': {'queue': 'mail'},
+    'backend.handlers.restore_mail': {'queue': 'mail'},
+    'new_user_registered': {'queue': 'mail'},
+    'new_order': {'queue': 'mail'},
+    'backend.handlers.send_invoices': {'queue': 'mail'},
+    'backend.handlers.send_invoice_digests': {'queue': 'mail'},
+}
+
+# сводки накладных по расписанию: celery -A orders.celery beat
+celery_app.conf.beat_schedule = {
+    'invoice-digests': {
+        'task': 'backend.handlers.send_invoice_digests',
+        'schedule': INVOICE_DIGEST_INTERVAL,
+    },
+    'restore-mail': {
+        'task': 'backend.handlers.restore_mail',
+        'schedule': MAIL_RESTORE_INTERVAL,
+    },
+}
+
 celery_app.autodiscover_tasks()
\ No newline at end of file
@@ -22,7 +22,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-dyj*w1w@=l9hr%@5#(x94wztyx936(ez#c-a=5!u(0hfe7fgk_'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DEBUG') == '1'
 
 ALLOWED_HOSTS = ['*']
 
@@ -36,9 +36,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_rest_passwordreset',
+    'django_filters',
 
     'backend',
 
@@ -49,33 +51,22 @@ INSTALLED_APPS = [
     'allauth.socialaccount.providers.github'
 ]
 
-REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 40,
-
-    'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-
-    ),
-
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-    ),
-
-}
-
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # сжимает ответы от 200 байт, если клиент принимает gzip
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'allauth.account.middleware.AccountMiddleware',
 ]
 
 ROOT_URLCONF = 'orders.urls'
+# под uvicorn (orders.asgi) горячие чтения обслуживают async-представления
+ASGI_URLCONF = 'orders.asgi_urls'
 
 TEMPLATES = [
     {
@@ -159,16 +150,21 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,
 
+    # ujson вместо стандартного json, HTML-интерфейс API только при отладке
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'backend.renderers.UJSONRenderer',
+    ) + (('rest_framework.renderers.BrowsableAPIRenderer',) if DEBUG else ()),
 
+    'DEFAULT_PARSER_CLASSES': (
+        'backend.renderers.UJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        # токены из кэша, BasicAuthentication хэширует пароль на каждом запросе и в API не используется
+        'backend.authentication.CachedTokenAuthentication',
     ),
 
     'DEFAULT_THROTTLE_CLASSES': [
@@ -203,6 +199,33 @@ BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 CELERY_RESULT_BACKEND = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
 CELERY_ALWAYS_EAGER = True
 
+# очередь исходящих писем в Redis: письма копятся MAIL_DISPATCH_DELAY секунд
+# и уходят пачками по MAIL_BATCH_SIZE через одно SMTP-соединение
+MAIL_QUEUE_URL = CELERY_BROKER_URL
+MAIL_DISPATCH_DELAY = 5
+MAIL_BATCH_SIZE = 100
+# повторы неотправленных писем: MAIL_RETRY_BACKOFF, 2 * MAIL_RETRY_BACKOFF, ... секунд
+MAIL_MAX_RETRIES = 5
+MAIL_RETRY_BACKOFF = 30
+# письма упавшей рассылки возвращаются в очередь не раньше чем через MAIL_RESTORE_INTERVAL секунд,
+# интервал должен быть больше времени отправки одной пачки
+MAIL_RESTORE_INTERVAL = 60 * 5
+# накладные по заказам: администратор получает каждый заказ целиком,
+# магазины в режиме сводки - одно письмо раз в INVOICE_DIGEST_INTERVAL секунд
+INVOICE_ADMIN_EMAILS = [EMAIL_HOST_USER]
+INVOICE_DIGEST_INTERVAL = 60 * 60
+# outbox: задачи пишутся в базу вместе с заказом или пользователем,
+# relay_outbox отправляет их в брокер пачками по OUTBOX_BATCH_SIZE раз в OUTBOX_POLL_INTERVAL секунд
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL = 1
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1',
+    }
+}
+
 
 
 SITE_ID = 1
@@ -214,4 +237,32 @@ LOGIN_REDIRECT_URL = 'home'
 ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_USERNAME_REQUIRED = False
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
-ACCOUNT_LOGIN_ATTEMPTS_TIMEOUT = 60
\ No newline at end of file
+ACCOUNT_LOGIN_ATTEMPTS_TIMEOUT = 60
+
+# размер пачки для bulk-операций импорта прайсов
+IMPORT_BATCH_SIZE = 1000
+# прайс скачивается частями во временный файл
+IMPORT_CHUNK_SIZE = 1024 * 1024
+IMPORT_TIMEOUT = 60
+# сколько записей прайса держится в памяти, если goods и categories идут раньше ключа shop,
+# и сколько якорей yaml (&anchor) допускается в одном прайсе; при превышении импорт завершается ошибкой
+IMPORT_MAX_PENDING = 10000
+IMPORT_MAX_ANCHORS = 1000
+# число позиций в одной задаче параллельного импорта
+IMPORT_SHARD_SIZE = 10000
+# через сколько секунд незавершенный импорт считается зависшим
+IMPORT_JOB_TIMEOUT = 60 * 60
+# время жизни кэша ответов каталога, сбрасывается раньше при импорте и смене статуса магазина
+CATALOG_CACHE_TIMEOUT = 60 * 15
+# время жизни кэша списков категорий и магазинов, сбрасывается раньше сигналами и импортом
+LIST_CACHE_TIMEOUT = 60 * 60
+# полнотекстовый поиск по каталогу
+SEARCH_CONFIG = 'russian'
+SEARCH_FACET_LIMIT = 50
+# сколько секунд хранится ответ на запрос с заголовком Idempotency-Key
+IDEMPOTENCY_TIMEOUT = 60 * 60 * 24
+# сколько секунд держится отметка о выполняемом запросе: если процесс упал посреди запроса,
+# повтор с тем же ключом станет возможен через несколько таймаутов запроса, а не через сутки
+IDEMPOTENCY_LOCK_TIMEOUT = 60 * 2
+# время жизни кэша токенов, сбрасывается раньше при выходе и изменении пользователя
+TOKEN_CACHE_TIMEOUT = 60 * 5